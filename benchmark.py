@@ -0,0 +1,280 @@
+"""
+CAHSI Hackathon Question Generator - BENCHMARK
+===============================================
+Times every stage of the generator against local stand-ins, so results
+don't depend on cataas.com or on having steghide installed.
+
+Stages: fetch_cat_image, image normalization (JPEG pass-through and PNG
+re-encode), cover planning, procedural cover synthesis, steg_with_steghide,
+verify_with_steghide, the encoding ciphers, and the spreadsheet writers.
+
+USAGE:
+    python benchmark.py                                  # 100 questions, fake steghide
+    python benchmark.py --questions 500 --output bench.json
+    python benchmark.py --steghide real                  # time the real steghide binary
+    python benchmark.py --compare before.json --output after.json
+
+The HTTP stand-in serves fixture JPEGs from memory on 127.0.0.1. The fake
+steghide backend just appends the flag to the cover - it is NOT steghide
+compatible and exists only to time the rest of the pipeline.
+"""
+
+import argparse
+import http.server
+import io
+import json
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import steghide_generator as sg
+
+
+def make_fixture_images(count, seed=0, size=(640, 480)):
+    """Noisy JPEG covers (bytes) for the stand-in server"""
+    from PIL import Image
+
+    rng = random.Random(seed)
+    images = []
+    for i in range(count):
+        noise = Image.effect_noise(size, rng.randint(20, 90)).convert("RGB")
+        tint = Image.new("RGB", size, (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        img = Image.blend(noise, tint, 0.5)
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=90)
+        images.append(out.getvalue())
+    return images
+
+
+def to_png(jpeg_bytes):
+    """Re-save a fixture as PNG, so normalization has to decode and re-encode it"""
+    from PIL import Image
+
+    out = io.BytesIO()
+    Image.open(io.BytesIO(jpeg_bytes)).save(out, "PNG")
+    return out.getvalue()
+
+
+class LocalImageServer:
+    """Stand-in for cataas.com: serves fixture images over HTTP on localhost"""
+
+    def __init__(self, images):
+        self.images = images
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real API
+
+            def do_GET(self):
+                body = random.choice(server.images)
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/cat"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeSteghide(sg.SteghideBackend):
+    """In-process stand-in for steghide (appends the flag after the JPEG data)"""
+
+    name = "fake"
+    MARKER = b"\xff\xfeFAKESTEG"
+
+    def embed(self, cover_image, flag, output_image, timeout=None):
+        """Write cover + marker + flag"""
+        cover = cover_image if isinstance(cover_image, bytes) else Path(cover_image).read_bytes()
+        Path(output_image).write_bytes(cover + self.MARKER + flag.encode("utf-8"))
+        return output_image
+
+    def extract(self, steg_image, timeout=None):
+        """Read back whatever follows the marker"""
+        data = steg_image if isinstance(steg_image, bytes) else Path(steg_image).read_bytes()
+        if self.MARKER not in data:
+            return None
+        return data.split(self.MARKER, 1)[1].decode("utf-8")
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class StageTimer:
+    """Collects per-operation latencies for each stage"""
+
+    def __init__(self):
+        self.samples = {}
+        self.wall = {}
+
+    def time(self, stage, func, items):
+        """Call func(item) for every item, timing each call; returns the results"""
+        samples = self.samples.setdefault(stage, [])
+        results = []
+        start = time.perf_counter()
+        for item in items:
+            t0 = time.perf_counter()
+            results.append(func(item))
+            samples.append(time.perf_counter() - t0)
+        self.wall[stage] = self.wall.get(stage, 0) + time.perf_counter() - start
+        return results
+
+    def summary(self):
+        """Throughput and latency percentiles (milliseconds) per stage"""
+        report = {}
+        for stage, samples in self.samples.items():
+            ordered = sorted(samples)
+            report[stage] = {
+                'count': len(samples),
+                'total_s': round(self.wall[stage], 6),
+                'throughput_per_s': round(len(samples) / self.wall[stage], 2) if self.wall[stage] else None,
+                'p50_ms': round(percentile(ordered, 50) * 1000, 4),
+                'p95_ms': round(percentile(ordered, 95) * 1000, 4),
+                'p99_ms': round(percentile(ordered, 99) * 1000, 4),
+            }
+        return report
+
+
+def git_commit():
+    """Current commit hash, if we're in a git checkout"""
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, timeout=5, cwd=Path(__file__).parent)
+        return result.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run_benchmark(questions=100, steghide="fake", cipher_calls=10000, fixtures=20, seed=0):
+    """Time every stage; returns the JSON-ready results"""
+    timer = StageTimer()
+    random.seed(seed)
+    images = make_fixture_images(fixtures, seed=seed)
+
+    with tempfile.TemporaryDirectory() as workdir, LocalImageServer(images) as server:
+        workdir = Path(workdir)
+        source = sg.HttpImageSource(server.url, rate_limiter=sg.RateLimiter(rate=0))
+        backend = FakeSteghide() if steghide == "fake" else "subprocess"
+        gen = sg.SteghideGenerator(workdir / "steg", "bench", image_source=source, backend=backend)
+
+        # Steganography stages, one question at a time
+        covers = timer.time("fetch_cat_image", lambda i: gen.fetch_cat_image(f"bench_{i:05d}.jpg"),
+                            range(questions))
+        timer.time("normalize_cover", sg.normalize_cover,
+                   [images[i % len(images)] for i in range(questions)])
+        pngs = [to_png(image) for image in images]
+        timer.time("normalize_cover_png", sg.normalize_cover,
+                   [pngs[i % len(pngs)] for i in range(questions)])
+        timer.time("plan_cover", lambda cover: sg.plan_cover(cover.read_bytes(), 22),
+                   [cover for cover in covers if cover])
+        procedural = sg.ProceduralSource(seed, text="Bench")
+        timer.time("procedural_cover", lambda _: procedural.fetch(), range(questions))
+
+        jobs = [(cover, gen.generate_flag("BEN", 12), gen.stegged_dir / f"bench_{i:05d}_steg.jpg")
+                for i, cover in enumerate(covers) if cover]
+        timer.time("steg_with_steghide", lambda job: gen.steg_with_steghide(*job), jobs)
+        verified = timer.time("verify_with_steghide",
+                              lambda job: gen.verify_with_steghide(job[2], job[1]), jobs)
+
+        # Encoding ciphers
+        enc = sg.CompleteEncodingGenerator(workdir / "enc", "bench")
+        flags = [enc.generate_flag("BEN", 12) for _ in range(cipher_calls)]
+        for name, func in [
+            ("cipher_caesar3", lambda f: enc.caesar_cipher(f, 3)),
+            ("cipher_rot13", enc.rot13),
+            ("cipher_atbash", enc.atbash),
+            ("cipher_base64", enc.base64_encode),
+            ("cipher_reverse", enc.reverse),
+            ("cipher_triple_chain", lambda f: enc.engine.encode(f, ("base64", "caesar7", "rot13"))),
+        ]:
+            timer.time(name, func, flags)
+        timer.time(f"cipher_batch_encode_{cipher_calls}", lambda batch: enc.encode_batch(batch, "base64->caesar7->rot13"),
+                   [flags] * 5)
+
+        # Spreadsheet writers
+        rows = enc.encode_chunk(enc.plan_questions(questions), "Bench", 1)
+        for fmt, sink_class in sg.ROW_SINKS.items():
+            try:
+                sink = sink_class(workdir / f"bench.{fmt}", sg.ENCODING_COLUMNS)
+            except ImportError as e:
+                print(f"Skipping {fmt} writer: {e}")
+                continue
+            timer.time(f"sheet_write_{fmt}", sink.write, rows)
+            timer.time(f"sheet_close_{fmt}", lambda _: sink.close(), [None])
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'questions': questions,
+            'steghide': steghide,
+            'cipher_calls': cipher_calls,
+            'verified': sum(1 for ok in verified if ok),
+        },
+        'stages': timer.summary(),
+    }
+
+
+def print_report(results, baseline=None):
+    """Table of per-stage results, with change vs a baseline run if given"""
+    print(f"\n{'='*96}")
+    meta = results['meta']
+    print(f"BENCHMARK  commit={meta['commit']}  questions={meta['questions']}  steghide={meta['steghide']}")
+    print(f"{'='*96}")
+    print(f"{'stage':<28}{'count':>8}{'ops/s':>12}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}  vs baseline")
+    for stage, row in results['stages'].items():
+        change = ""
+        if baseline and stage in baseline['stages'] and baseline['stages'][stage]['p50_ms']:
+            before = baseline['stages'][stage]['p50_ms']
+            change = f"p50 {(row['p50_ms'] - before) / before * 100:+.1f}%"
+        print(f"{stage:<28}{row['count']:>8}{row['throughput_per_s'] or 0:>12.1f}"
+              f"{row['p50_ms']:>11.3f}{row['p95_ms']:>11.3f}{row['p99_ms']:>11.3f}  {change}")
+    print(f"{'='*96}\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every generator stage against local stand-ins")
+    parser.add_argument("--questions", type=int, default=100, help="steg questions / sheet rows (default: 100)")
+    parser.add_argument("--cipher-calls", type=int, default=10000, help="calls per cipher (default: 10000)")
+    parser.add_argument("--steghide", choices=["fake", "real"], default="fake",
+                        help="fake in-process stand-in or the real steghide binary (default: fake)")
+    parser.add_argument("--output", help="save results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.questions, args.steghide, args.cipher_calls)
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    print_report(results, baseline)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+        print(f"✓ Results: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
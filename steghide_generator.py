@@ -6,7 +6,7 @@ Uses actual steghide command-line tool (Futureboy-compatible!)
 PREREQUISITES:
 1. Download steghide: https://sourceforge.net/projects/steghide/files/steghide/0.5.1/steghide-0.5.1-win32.zip
 2. Extract and copy the "steghide" folder to the same directory as this script
-3. pip install requests pillow pandas openpyxl
+3. pip install requests pillow numpy pandas openpyxl
 4. Create STUDENT_ID.txt with your student ID number
 
 USAGE:
@@ -15,309 +15,2748 @@ USAGE:
     (No arguments needed - it will prompt you for everything!)
 """
 
-import requests
+# pandas, PIL and requests are imported inside the functions that need them,
+# so quick runs (encodings only, verification, --help) start fast
 import random
+import secrets
 import string
-import pandas as pd
 from pathlib import Path
-from PIL import Image
 import io
 import time
 import base64
 import subprocess
 import os
+import hashlib
+import math
+import shutil
+import tempfile
+import contextlib
+import functools
+import re
+import csv
+import itertools
+import collections
+import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+
+# Separate RNG for retry jitter so backoff never disturbs flag generation
+_jitter = random.Random()
+
+
+def question_rng(seed, student_id, week, kind, index, attempt=0):
+    """Independent random stream for one question, keyed by its coordinates
+    
+    The same (master seed, student, week, kind, index) always gives the same
+    stream, whatever order, process or shard the question is made in.
+    attempt > 0 gives the stream for redrawing a flag that was already taken.
+    """
+    key = f"{seed}|{student_id}|{week}|{kind}|{index}"
+    if attempt:
+        key += f"|{attempt}"
+    return random.Random(key)
+
+
+def new_seed():
+    """Fresh master seed for runs that don't pass one"""
+    return secrets.token_hex(8)
+
+
+def backoff_delay(attempt, base=0.5, cap=10.0):
+    """Full-jitter exponential backoff: random delay in [0, min(cap, base * 2^attempt)]"""
+    return _jitter.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class Instrumentation:
+    """Timed spans and events from the hot paths, attributed per question
+    
+    Spans wrap the HTTP fetch, PIL decode/convert/encode, the steghide
+    subprocess and spreadsheet writes. Every finished span or event is a
+    dict handed to each hook from add_hook(); while a trace is recording it
+    is also kept for export as JSON lines or a Chrome trace.
+    """
+    
+    def __init__(self):
+        self.hooks = []
+        self.records = []
+        self.recording = False
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._epoch = time.perf_counter()
+        
+    def add_hook(self, func):
+        """Call func(record) for every span and event; returns func"""
+        self.hooks.append(func)
+        return func
+    
+    def remove_hook(self, func):
+        """Stop calling func"""
+        if func in self.hooks:
+            self.hooks.remove(func)
+    
+    @contextlib.contextmanager
+    def hooked(self, func):
+        """Call func(record) for every span and event inside the block; yields func"""
+        self.add_hook(func)
+        try:
+            yield func
+        finally:
+            self.remove_hook(func)
+    
+    def current_question(self):
+        """Question the calling thread is working on (None outside one)"""
+        return getattr(self._local, "question", None)
+    
+    @contextlib.contextmanager
+    def question(self, name):
+        """Attribute spans and events in this block (on this thread) to a question"""
+        previous = self.current_question()
+        self._local.question = name
+        try:
+            yield
+        finally:
+            self._local.question = previous
+    
+    def _emit(self, record):
+        """Hand a finished record to the hooks and the trace buffer"""
+        for hook in list(self.hooks):
+            try:
+                hook(record)
+            except Exception:
+                pass  # A broken hook must never break generation
+        if self.recording:
+            with self._lock:
+                self.records.append(record)
+    
+    def _stamp(self, record, start):
+        """Add time, thread and process fields to a record"""
+        record['start'] = start - self._epoch
+        record['thread'] = threading.current_thread().name
+        record['tid'] = threading.get_ident()
+        record['pid'] = os.getpid()
+    
+    @contextlib.contextmanager
+    def span(self, stage, **fields):
+        """Time the block as one `stage` span
+        
+        Yields the record so the block can add fields such as bytes, retries
+        or error. An exception marks the span failed and is re-raised; the
+        block can also set record['ok'] = False itself.
+        """
+        record = {'type': 'span', 'stage': stage, 'question': self.current_question(), 'ok': True}
+        record.update(fields)
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record['ok'] = False
+            record.setdefault('error', f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            record['duration'] = time.perf_counter() - start
+            self._stamp(record, start)
+            self._emit(record)
+    
+    def event(self, name, **fields):
+        """Record a point-in-time event (retry, failure, mismatch)"""
+        record = {'type': 'event', 'stage': name, 'question': self.current_question()}
+        record.update(fields)
+        self._stamp(record, time.perf_counter())
+        self._emit(record)
+    
+    @contextlib.contextmanager
+    def trace(self, path):
+        """Keep every record made inside the block and export them to path afterwards"""
+        with self._lock:
+            self.records = []
+        self.recording = True
+        try:
+            yield self
+        finally:
+            self.recording = False
+            self.export(path)
+            print(f"✓ Trace: {path} ({len(self.records)} records)")
+    
+    def export(self, path):
+        """Write the kept records: .json as a Chrome trace, anything else as JSON lines"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix == ".json":
+            self.export_chrome_trace(path)
+        else:
+            self.export_jsonl(path)
+    
+    def export_jsonl(self, path):
+        """One JSON object per span/event"""
+        with open(path, "w", encoding="utf-8") as f:
+            for record in self.records:
+                f.write(json.dumps(record, default=str) + "\n")
+    
+    def export_chrome_trace(self, path):
+        """Trace Event Format, for chrome://tracing or ui.perfetto.dev"""
+        events = []
+        for record in self.records:
+            args = {k: v for k, v in record.items()
+                    if k not in ('type', 'stage', 'start', 'duration', 'thread', 'tid', 'pid')}
+            event = {
+                'name': record['stage'],
+                'cat': 'span' if record['type'] == 'span' else 'event',
+                'ts': record['start'] * 1e6,
+                'pid': record['pid'],
+                'tid': record['tid'],
+                'args': args,
+            }
+            if record['type'] == 'span':
+                event.update(ph='X', dur=record['duration'] * 1e6)
+            else:
+                event.update(ph='i', s='t')
+            events.append(event)
+        Path(path).write_text(json.dumps({'traceEvents': events}, default=str))
+
+
+# Process-wide instrumentation; register hooks with instrumentation.add_hook()
+instrumentation = Instrumentation()
+
+
+class StageStats:
+    """Hook that totals span count, time, failures and bytes per stage"""
+    
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+        
+    def __call__(self, record):
+        if record['type'] != 'span':
+            return
+        with self._lock:
+            stats = self.stages.setdefault(record['stage'], {'count': 0, 'seconds': 0.0, 'failed': 0, 'bytes': 0})
+            stats['count'] += 1
+            stats['seconds'] += record['duration']
+            stats['failed'] += 0 if record['ok'] else 1
+            stats['bytes'] += record.get('bytes') or 0
+    
+    def print_report(self):
+        """Per-stage timing table"""
+        if not self.stages:
+            return
+        print(f"{'stage':<18}{'count':>7}{'failed':>8}{'total s':>10}{'avg ms':>10}{'MB':>9}")
+        for stage, stats in self.stages.items():
+            print(f"{stage:<18}{stats['count']:>7}{stats['failed']:>8}{stats['seconds']:>10.2f}"
+                  f"{stats['seconds'] / stats['count'] * 1000:>10.1f}{stats['bytes'] / 1e6:>9.2f}")
+
+
+class Progress:
+    """Throughput and ETA for a run of `total` items"""
+    
+    def __init__(self, total, done=0):
+        self.total = total
+        self.done = done
+        self.first = done
+        self.start = time.time()
+        
+    def tick(self, count=1):
+        """Count finished items; returns the rate/ETA text"""
+        self.done += count
+        return str(self)
+    
+    def __str__(self):
+        elapsed = time.time() - self.start
+        rate = (self.done - self.first) / elapsed if elapsed > 0 else 0
+        remaining = self.total - self.done
+        eta = f"ETA {remaining / rate:.0f}s" if rate and remaining > 0 else "ETA -"
+        return f"{rate:.1f}/s, {eta}"
+
+
+class RateLimiter:
+    """Token bucket shared by every fetch worker
+    
+    Allows short bursts of `burst` requests, then settles at `rate` requests
+    per second across all threads that share the limiter.
+    """
+    
+    def __init__(self, rate=2.0, burst=4):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+        
+    def acquire(self):
+        """Block until a request may be sent"""
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class FetchError(Exception):
+    """Cover image could not be fetched"""
+
+
+class PermanentFetchError(FetchError):
+    """Fetch failure that retrying will not fix (bad URL, 404, empty directory...)"""
+
+
+class ImageSource:
+    """Base class for cover image sources
+    
+    Subclasses implement fetch(), which returns the raw bytes of one image.
+    fetch() must be safe to call from several threads at once. Sources that
+    can make the cover for a given question themselves set indexed and
+    implement render(index, redraw=0) and with_stream(stream).
+    """
+    
+    name = "base"
+    indexed = False
+    
+    def fetch(self):
+        """Return the raw bytes of one cover image"""
+        raise NotImplementedError
+
+
+class HttpImageSource(ImageSource):
+    """Fetches images from an HTTP endpoint over a pooled keep-alive session
+    
+    Point `url` at any endpoint that returns an image per GET, e.g. a local
+    stand-in server for offline runs and benchmarks.
+    """
+    
+    name = "http"
+    
+    # Worth retrying: timeouts, throttling and server-side errors
+    RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+    
+    def __init__(self, url, max_attempts=10, timeout=15, pool_size=16, rate_limiter=None):
+        self.url = url
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter or RateLimiter()
+        
+        import requests
+        
+        # One session for every worker: connections (and TLS) are reused
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        
+    def fetch(self):
+        """GET one image, retrying transient failures with jittered backoff"""
+        import requests
+        
+        last_error = None
+        
+        with instrumentation.span("http_fetch", url=self.url, retries=0, wait=0.0) as span:
+            for attempt in range(self.max_attempts):
+                waited = time.perf_counter()
+                self.rate_limiter.acquire()
+                span['wait'] += time.perf_counter() - waited
+                span['retries'] = attempt
+                try:
+                    response = self.session.get(self.url, timeout=self.timeout)
+                except (requests.exceptions.InvalidURL, requests.exceptions.MissingSchema,
+                        requests.exceptions.InvalidSchema) as e:
+                    raise PermanentFetchError(f"bad URL {self.url}: {e}") from e
+                except requests.RequestException as e:
+                    last_error = e
+                else:
+                    if response.ok and response.content:
+                        span['bytes'] = len(response.content)
+                        return response.content
+                    if response.ok:
+                        last_error = "empty response"
+                    elif response.status_code in self.RETRY_STATUSES:
+                        last_error = f"HTTP {response.status_code}"
+                    else:
+                        raise PermanentFetchError(f"HTTP {response.status_code} from {self.url}")
+                
+                if attempt < self.max_attempts - 1:
+                    instrumentation.event("http_retry", attempt=attempt + 1, reason=str(last_error))
+                    time.sleep(backoff_delay(attempt))
+            
+            raise FetchError(f"gave up after {self.max_attempts} attempts: {last_error}")
+
+
+class CataasSource(HttpImageSource):
+    """Random cat pictures from cataas.com"""
+    
+    name = "cataas"
+    
+    def __init__(self, url="https://cataas.com/cat", **kwargs):
+        super().__init__(url, **kwargs)
+
+
+class LocalDirectorySource(ImageSource):
+    """Serves images from a local folder (offline runs, build boxes)"""
+    
+    name = "directory"
+    
+    EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp"}
+    
+    def __init__(self, directory, shuffle=True):
+        self.directory = Path(directory)
+        self.files = sorted(
+            path for path in self.directory.iterdir()
+            if path.suffix.lower() in self.EXTENSIONS
+        ) if self.directory.is_dir() else []
+        if shuffle:
+            _jitter.shuffle(self.files)
+        self._next = 0
+        self._lock = threading.Lock()
+        
+    def fetch(self):
+        """Return the next image in the folder, cycling when exhausted"""
+        if not self.files:
+            raise PermanentFetchError(f"no images found in {self.directory}")
+        with self._lock:
+            path = self.files[self._next % len(self.files)]
+            self._next += 1
+        with instrumentation.span("disk_read", path=str(path)) as span:
+            data = path.read_bytes()
+            span['bytes'] = len(data)
+        return data
+
+
+class ProceduralSource(ImageSource):
+    """Synthesizes photo-like JPEG covers locally (air-gapped runners, no network)
+    
+    Each cover layers a colour gradient, multi-octave value noise, a few
+    soft-edged shapes and the theme text, then adds fine grain so every
+    8x8 block keeps non-zero DCT coefficients for steghide to use. Cover
+    number n of a (seed, stream) is always the same image. Generators ask
+    for render(question index) directly, so a question's cover doesn't
+    depend on thread timing; fetch() hands out n = 0, 1, 2... for
+    everything else. Give each student-week its own stream so they don't
+    share covers.
+    """
+    
+    name = "procedural"
+    indexed = True
+    
+    def __init__(self, seed=None, size=(640, 480), text="CAHSI", quality=92, min_capacity=1024, stream=""):
+        self.seed = new_seed() if seed is None else seed
+        self.size = size
+        self.text = text
+        self.quality = quality
+        self.min_capacity = min_capacity  # Estimated steghide bytes every cover must hold
+        self._root = int.from_bytes(hashlib.sha256(f"{self.seed}\0{stream}".encode()).digest()[:8], "big")
+        self._next = itertools.count()
+    
+    def with_stream(self, stream):
+        """The same source (seed, size, text) on another stream"""
+        return ProceduralSource(self.seed, self.size, self.text, self.quality, self.min_capacity, stream)
+    
+    def fetch(self):
+        """Return the next synthetic cover as JPEG bytes"""
+        return self.render(next(self._next))
+    
+    def noise(self, rng, size, octaves=5):
+        """Fractal value noise in [0, 1], shape (height, width, 3)"""
+        from PIL import Image
+        import numpy as np
+        
+        width, height = size
+        total = np.zeros((height, width, 3), dtype=np.float32)
+        weight = 1.0
+        for octave in range(octaves):
+            cells = 2 ** (octave + 2)
+            grid = rng.integers(0, 256, (cells * height // width + 1, cells + 1, 3), dtype=np.uint8)
+            layer = Image.fromarray(grid, "RGB").resize(size, Image.Resampling.BICUBIC)
+            total += weight * np.asarray(layer, dtype=np.float32)
+            weight /= 2
+        return total / (255 * (2 - weight * 2))
+    
+    def render(self, n, redraw=0):
+        """Cover number n as JPEG bytes (redraw > 0: a replacement for a cover that failed)"""
+        from PIL import Image, ImageDraw, ImageFilter, ImageFont
+        import numpy as np
+        
+        rng = np.random.default_rng([self._root, n, redraw] if redraw else [self._root, n])
+        width, height = self.size
+        
+        with instrumentation.span("procedural_cover", index=n) as span:
+            # The smooth layers are drawn at half size and scaled up once: a
+            # quarter of the pixels to compute, and no visible difference
+            small = (width // 2, height // 2)
+            
+            # Gradient between two random colours at a random angle
+            angle = rng.uniform(0, 2 * np.pi)
+            ramp = (np.arange(small[0], dtype=np.float32)[None, :] * np.cos(angle)
+                    + np.arange(small[1], dtype=np.float32)[:, None] * np.sin(angle))
+            ramp = ((ramp - ramp.min()) / np.ptp(ramp))[..., None]
+            start, end = rng.uniform(0, 255, (2, 3)).astype(np.float32)
+            pixels = start + ramp * (end - start)
+            
+            # Texture: blend in tinted fractal noise
+            tint = rng.uniform(0.5, 1.5, 3).astype(np.float32)
+            pixels = pixels * 0.55 + self.noise(rng, small) * (255 * 0.45 * tint)
+            img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), "RGB")
+            
+            # A few translucent, soft-edged shapes
+            overlay = Image.new("RGBA", small, (0, 0, 0, 0))
+            draw = ImageDraw.Draw(overlay)
+            for _ in range(rng.integers(3, 9)):
+                x0, x1 = sorted(rng.integers(-small[0] // 4, small[0] * 5 // 4, 2))
+                y0, y1 = sorted(rng.integers(-small[1] // 4, small[1] * 5 // 4, 2))
+                fill = tuple(int(c) for c in rng.integers(0, 256, 3)) + (int(rng.integers(60, 170)),)
+                shape = draw.ellipse if rng.random() < 0.6 else draw.rectangle
+                shape((int(x0), int(y0), int(x1) + 1, int(y1) + 1), fill=fill)
+            overlay = overlay.filter(ImageFilter.GaussianBlur(rng.uniform(0.5, 3)))
+            img = Image.alpha_composite(img.convert("RGBA"), overlay).convert("RGB")
+            img = img.resize(self.size, Image.Resampling.BILINEAR)
+            
+            # Theme text, at full resolution so its edges stay sharp
+            if self.text:
+                try:
+                    font = ImageFont.load_default(size=int(height * rng.uniform(0.08, 0.16)))
+                except TypeError:  # Pillow < 10.1 has a single fixed-size default font
+                    font = ImageFont.load_default()
+                colour = tuple(int(c) for c in rng.integers(0, 256, 3))
+                ImageDraw.Draw(img).text((int(rng.integers(0, width // 2)), int(rng.integers(0, height * 3 // 4))),
+                                         self.text, fill=colour, font=font)
+            
+            # Fine grain gives every block high-frequency coefficients to hide bits in;
+            # a cover that still comes out too smooth gets more grain
+            base = np.asarray(img, dtype=np.float32)
+            for sigma in (6, 12, 24):
+                grain = rng.standard_normal((height, width, 1), dtype=np.float32) * sigma
+                out = io.BytesIO()
+                Image.fromarray(np.clip(base + grain, 0, 255).astype(np.uint8), "RGB").save(
+                    out, "JPEG", quality=self.quality)
+                capacity = estimate_capacity(Image.open(out))
+                if capacity >= self.min_capacity:
+                    break
+            span.update(bytes=out.tell(), capacity=capacity, grain=sigma)
+        return out.getvalue()
+
+
+def is_procedural_spec(spec):
+    """Whether an image source spec names the procedural source"""
+    return spec == "procedural" or spec.startswith("procedural:")
+
+
+def make_image_source(spec="cataas", theme=None, **kwargs):
+    """Build an image source from a short spec
+    
+    "cataas"                  -> CataasSource
+    "http://host:port/path"   -> HttpImageSource (e.g. a local stand-in)
+    "dir:/path/to/images"     -> LocalDirectorySource
+    "procedural[:SEED]"       -> ProceduralSource (theme is drawn on the covers;
+                                 SEED defaults to the seed keyword)
+    """
+    stream = kwargs.pop("stream", "")
+    seed = kwargs.pop("seed", None)
+    if is_procedural_spec(spec):
+        seed = spec.partition(":")[2] or seed
+        return ProceduralSource(seed, text=theme or "CAHSI", stream=stream)
+    if spec == "cataas":
+        return CataasSource(**kwargs)
+    if spec.startswith(("http://", "https://")):
+        return HttpImageSource(spec, **kwargs)
+    if spec.startswith("dir:"):
+        return LocalDirectorySource(spec[4:])
+    if Path(spec).is_dir():
+        return LocalDirectorySource(spec)
+    raise ValueError(f"Unknown image source: {spec}")
+
+
+# Cover limits: anything that would encode over MAX_COVER_BYTES is shrunk to fit MAX_COVER_SIDE
+MAX_COVER_BYTES = 2 * 1024 * 1024
+MAX_COVER_SIDE = 1920
+
+# Typical size of a quality-95 JPEG photo, used to predict the output before encoding
+JPEG_Q95_BYTES_PER_PIXEL = 0.6
+
+
+def is_ready_cover(img, data):
+    """True if data is already a baseline RGB JPEG within MAX_COVER_BYTES (judged from the header)"""
+    return (img.format == 'JPEG' and img.mode == 'RGB'
+            and not img.info.get('progressive')
+            and len(data) <= MAX_COVER_BYTES
+            and data.rstrip(b"\0").endswith(b"\xff\xd9"))  # Not a truncated download
+
+
+def normalize_cover(data):
+    """Decode any image and re-encode it as a steghide-friendly RGB JPEG (bytes)
+    
+    Covers that are already baseline RGB JPEGs within the size limit are
+    returned as-is, without decoding. Everything else is decoded once; when
+    the output is predicted to exceed MAX_COVER_BYTES the image is shrunk
+    while decoding (JPEG draft mode) and then encoded a single time.
+    """
+    from PIL import Image
+    
+    img = Image.open(io.BytesIO(data))  # Parses the header only
+    
+    if is_ready_cover(img, data):
+        instrumentation.event("cover_passthrough", bytes=len(data))
+        return data
+    
+    # Predict the encoded size so an oversized cover is shrunk before it is encoded
+    shrink = img.width * img.height * JPEG_Q95_BYTES_PER_PIXEL > MAX_COVER_BYTES
+    
+    with instrumentation.span("pil_decode", bytes=len(data), format=img.format, shrink=shrink):
+        if shrink:
+            # JPEG draft mode lets the decoder itself downscale by 1/2-1/8, as far
+            # as it can while staying at least as big as the final size
+            scale = min(1.0, MAX_COVER_SIDE / max(img.size))
+            img.draft('RGB', (int(img.width * scale), int(img.height * scale)))
+            img.thumbnail((MAX_COVER_SIDE, MAX_COVER_SIDE), Image.Resampling.LANCZOS, reducing_gap=None)
+        else:
+            img.load()
+    
+    # Convert to RGB for JPEG
+    with instrumentation.span("pil_convert", mode=img.mode):
+        if img.mode == 'P':
+            img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+        if img.mode in ('RGBA', 'LA'):
+            # Flatten transparency onto white
+            rgb_img = Image.new('RGB', img.size, (255, 255, 255))
+            rgb_img.paste(img, mask=img.getchannel('A'))
+            img = rgb_img
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+    
+    # Save as JPEG (steghide supports JPEG)
+    with instrumentation.span("pil_encode") as span:
+        out = io.BytesIO()
+        img.save(out, 'JPEG', quality=90 if shrink else 95)
+        
+        # Prediction was too optimistic: shrink and encode again (still in memory)
+        if out.tell() > MAX_COVER_BYTES and not shrink:
+            img.thumbnail((MAX_COVER_SIDE, MAX_COVER_SIDE), Image.Resampling.LANCZOS)
+            out = io.BytesIO()
+            img.save(out, 'JPEG', quality=90)
+            span['reencoded'] = True
+        span['bytes'] = out.tell()
+    
+    return out.getvalue()
+
+
+# Cover planning: the flag is tiny, so embed into the smallest cover that still
+# leaves CAPACITY_MARGIN times the payload free. Sizes are long-side pixels.
+PLANNED_COVER_SIDES = (640, 960, 1280)
+CAPACITY_MARGIN = 4
+STEGHIDE_OVERHEAD = 64  # Header, CRC, encryption IV and block padding (bytes)
+
+
+@functools.lru_cache(maxsize=1)
+def dct_matrix():
+    """8x8 DCT-II basis, as used by JPEG"""
+    import numpy as np
+    
+    k = np.arange(8)
+    basis = np.cos((2 * k[None, :] + 1) * k[:, None] * np.pi / 16) / 2
+    basis[0] /= np.sqrt(2)
+    return basis
+
+
+def estimate_capacity(img):
+    """Conservative steghide capacity (bytes) of a decoded JPEG
+    
+    steghide hides one bit per three non-zero quantized DCT coefficients.
+    Only the luminance channel is counted, so the real capacity is higher.
+    """
+    import numpy as np
+    
+    table = np.array(img.quantization[0], dtype=np.float32).reshape(8, 8)
+    luma = np.asarray(img.convert('L'), dtype=np.float32) - 128
+    height, width = (side - side % 8 for side in luma.shape)
+    blocks = luma[:height, :width].reshape(height // 8, 8, width // 8, 8).swapaxes(1, 2)
+    basis = dct_matrix()
+    coefficients = basis @ blocks @ basis.T
+    nonzero = np.count_nonzero(np.rint(coefficients / table))
+    return int(nonzero) // 3 // 8
+
+
+def plan_cover(jpeg_bytes, payload_bytes, margin=CAPACITY_MARGIN, sides=PLANNED_COVER_SIDES):
+    """Shrink a normalized cover to the smallest size with enough capacity for the payload
+    
+    Returns (jpeg_bytes, plan) where plan records the chosen size, the
+    estimated capacity and the payload. Tries each size in `sides` in turn
+    and keeps the original cover if none of them has room.
+    """
+    from PIL import Image
+    
+    needed = (payload_bytes + STEGHIDE_OVERHEAD) * margin
+    
+    with instrumentation.span("plan_cover", bytes=len(jpeg_bytes), payload=payload_bytes) as span:
+        img = Image.open(io.BytesIO(jpeg_bytes))
+        original_side = max(img.size)
+        
+        for side in sides:
+            if side >= original_side:
+                break
+            scale = side / original_side
+            smaller = img.resize((max(8, round(img.width * scale)), max(8, round(img.height * scale))),
+                                 Image.Resampling.LANCZOS)
+            out = io.BytesIO()
+            smaller.save(out, 'JPEG', quality=95)
+            candidate = Image.open(out)
+            capacity = estimate_capacity(candidate)
+            if capacity >= needed:
+                plan = {'width': candidate.width, 'height': candidate.height,
+                        'capacity': capacity, 'payload': payload_bytes, 'resized': True}
+                span.update(plan)
+                return out.getvalue(), plan
+        
+        plan = {'width': img.width, 'height': img.height,
+                'capacity': estimate_capacity(img), 'payload': payload_bytes, 'resized': False}
+        span.update(plan)
+        return jpeg_bytes, plan
+
+
+def fetch_cover(image_source, max_attempts=3):
+    """Fetch one image from a source and return it normalized
+    
+    The source retries network errors itself; here we only retry images
+    that downloaded fine but could not be decoded.
+    """
+    for attempt in range(max_attempts):
+        data = image_source.fetch()
+        try:
+            return normalize_cover(data)
+        except Exception as e:
+            last_error = e
+    raise FetchError(f"could not decode image: {last_error}")
+
+
+class CoverCache:
+    """Shared on-disk pool of normalized cover JPEGs, keyed by content hash
+    
+    Covers are stored as <sha256>.jpg, so identical downloads are kept once.
+    A file's mtime is its last-use time: when the pool grows past max_bytes
+    the least recently used covers are evicted. Several generators (and
+    processes) can share one cache directory; writes are atomic renames.
+    
+    Every cover is handed out once, ever: take() claims it with a marker
+    file in issued/ (an exclusive create, so two processes can't both win),
+    and returns None once every cached cover is issued, so the caller
+    fetches fresh ones. With reuse=True covers are only unique per
+    instance, and later runs draw from the same pool again.
+    
+    A claimed cover is also held (a marker in held/) until its run is done
+    with it: unhold() after embedding, or never when the run's manifest
+    keeps pointing at it (--no-originals). Held covers are never evicted.
+    """
+    
+    def __init__(self, root="cover_cache", max_bytes=500 * 1024 * 1024, image_source=None, reuse=False):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.issued_dir = self.root / "issued"
+        self.issued_dir.mkdir(exist_ok=True)
+        self.held_dir = self.root / "held"
+        self.held_dir.mkdir(exist_ok=True)
+        self.max_bytes = max_bytes
+        self.image_source = image_source
+        self.reuse = reuse
+        self.taken = set()  # Covers already handed out by this instance
+        self._lock = threading.Lock()
+        
+    def is_issued(self, path):
+        """True if some run has already been handed this cover"""
+        return (self.issued_dir / path.name).exists()
+    
+    def is_held(self, path):
+        """True if a run still needs this cover (claimed and not yet used, or referenced)"""
+        return (self.held_dir / path.name).exists()
+    
+    def claim(self, path):
+        """Mark a cover issued and held; False if another run got there first"""
+        if not self.reuse:
+            try:
+                os.close(os.open(self.issued_dir / path.name, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            except FileExistsError:
+                return False
+        (self.held_dir / path.name).touch()
+        return True
+    
+    def unhold(self, path):
+        """Let eviction have a cover again once its run no longer needs the file"""
+        (self.held_dir / Path(path).name).unlink(missing_ok=True)
+    
+    def release(self, path):
+        """Give back an issued cover that was never used"""
+        if not self.reuse:
+            (self.issued_dir / Path(path).name).unlink(missing_ok=True)
+        self.unhold(path)
+        with self._lock:
+            self.taken.discard(Path(path).name)
+    
+    def available(self):
+        """Cached covers that have not been issued yet"""
+        return [path for path in self.covers() if self.reuse or not self.is_issued(path)]
+    
+    def path_for(self, digest):
+        """Cache path for a content hash"""
+        return self.root / f"{digest}.jpg"
+    
+    def covers(self):
+        """All cached cover paths"""
+        return list(self.root.glob("*.jpg"))
+    
+    def size(self):
+        """Total bytes used by the cache"""
+        total = 0
+        for path in self.covers():
+            try:
+                total += path.stat().st_size
+            except FileNotFoundError:
+                pass  # Evicted by another process meanwhile
+        return total
+    
+    def add(self, jpeg_bytes, taken=False):
+        """Store a normalized cover; returns its path (deduplicated by content)
+        
+        taken=True also issues it to the caller, and returns None instead if
+        the same image was already issued to someone else.
+        """
+        digest = hashlib.sha256(jpeg_bytes).hexdigest()
+        path = self.path_for(digest)
+        
+        if path.exists():
+            os.utime(path)  # Counts as a use
+        else:
+            tmp = self.root / f".{digest}.{os.getpid()}.{threading.get_ident()}.tmp"
+            tmp.write_bytes(jpeg_bytes)
+            os.replace(tmp, path)
+        
+        issued = taken and self.claim(path)
+        if issued:
+            with self._lock:
+                self.taken.add(path.name)
+        
+        self.evict()
+        return None if taken and not issued else path
+    
+    def take(self):
+        """Hand out a cover no run has been given yet (least recently used first), or None"""
+        with self._lock:
+            candidates = []
+            for path in self.available():
+                if path.name in self.taken:
+                    continue
+                try:
+                    candidates.append((path.stat().st_mtime, path))
+                except FileNotFoundError:
+                    continue
+            
+            for _, path in sorted(candidates):
+                if self.claim(path):
+                    self.taken.add(path.name)
+                    break
+            else:
+                return None
+        
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return self.take()  # Evicted under our feet, try another
+        return path
+    
+    def evict(self):
+        """Drop covers until the cache fits in max_bytes: used ones first, then least recently used
+        
+        Held covers are skipped, so the cache can stay over budget while
+        runs still need them. Issued markers are kept, so a later download
+        of the same image is still recognised as used.
+        """
+        entries = []
+        for path in self.covers():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            fresh = self.reuse or not self.is_issued(path)
+            entries.append((fresh, stat.st_mtime, stat.st_size, path))
+        
+        total = sum(size for _, _, size, _ in entries)
+        for _, _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if self.is_held(path):
+                continue  # Claimed and not used yet, or still referenced
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+    
+    def prefetch(self, count, workers=8):
+        """Download `count` covers into the pool ahead of time; returns how many were new"""
+        if not self.image_source:
+            raise ValueError("CoverCache has no image_source to prefetch from")
+        
+        before = {path.name for path in self.covers()}
+        
+        def fetch_one(_):
+            try:
+                return fetch_cover(self.image_source)
+            except FetchError as e:
+                print(f"✗ Failed to fetch image: {e}")
+                return None
+        
+        added = set()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for i, data in enumerate(pool.map(fetch_one, range(count)), 1):
+                if data:
+                    added.add(self.add(data).name)
+                print(f"\rPrefetched {i}/{count}", end="", flush=True)
+        print()
+        
+        return len(added - before)
+
+
+class StagePipeline:
+    """Runs items through a chain of stages, each with its own worker pool
+    
+    Stages are (name, func, workers) tuples. Every stage reads from a bounded
+    queue, so a slow stage applies back-pressure to the one before it instead
+    of letting work pile up in memory. A stage function returns the item for
+    the next stage, or None to drop it (the failure is counted per stage).
+    """
+    
+    _DONE = object()
+    
+    def __init__(self, stages, queue_size=8):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.failures = {name: 0 for name, _, _ in stages}
+        self.on_drop = None
+        self._lock = threading.Lock()
+        
+    def _worker(self, name, func, inbox, outbox):
+        """Pull items from inbox, process them, push results to outbox"""
+        while True:
+            item = inbox.get()
+            if item is self._DONE:
+                inbox.put(self._DONE)  # Let sibling workers see it too
+                return
+            try:
+                result = func(item)
+            except Exception as e:
+                print(f"\n✗ {name} stage error: {e}")
+                result = None
+            if result is None:
+                with self._lock:
+                    self.failures[name] += 1
+                if self.on_drop:
+                    self.on_drop(name, item)
+                continue
+            outbox.put(result)
+    
+    def run(self, items, on_result=None, on_drop=None):
+        """Feed items through every stage and return the final results
+        
+        on_result(item) is called from the calling thread as items finish;
+        on_drop(stage_name, item) is called from a worker when a stage drops one.
+        """
+        self.on_drop = on_drop
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        queues.append(queue.Queue())  # Unbounded sink so the last stage never blocks
+        
+        pools = []
+        for (name, func, workers), inbox, outbox in zip(self.stages, queues, queues[1:]):
+            threads = [
+                threading.Thread(target=self._worker, args=(name, func, inbox, outbox), daemon=True)
+                for _ in range(max(1, workers))
+            ]
+            for t in threads:
+                t.start()
+            pools.append(threads)
+        
+        def feed():
+            for item in items:
+                queues[0].put(item)
+            queues[0].put(self._DONE)
+        
+        def close():
+            # Shut stages down in order: once a pool has drained, signal the next one
+            for threads, outbox in zip(pools, queues[1:]):
+                for t in threads:
+                    t.join()
+                outbox.put(self._DONE)
+        
+        threading.Thread(target=feed, daemon=True).start()
+        threading.Thread(target=close, daemon=True).start()
+        
+        results = []
+        while True:
+            item = queues[-1].get()
+            if item is self._DONE:
+                break
+            results.append(item)
+            if on_result:
+                on_result(item)
+        
+        return results
+
+
+class ReorderBuffer:
+    """Releases numbered items in order even when they finish out of order
+    
+    Call add(index, item) for finished items and skip(index) for ones that
+    will never arrive; emit(item) is called for each item in index order.
+    """
+    
+    def __init__(self, emit, start=1):
+        self.emit = emit
+        self.next_index = start
+        self.pending = {}
+        self._lock = threading.Lock()
+        
+    def add(self, index, item):
+        """Record a finished item"""
+        with self._lock:
+            self.pending[index] = item
+            self._release()
+    
+    def skip(self, index):
+        """Record that an index will never produce an item"""
+        self.add(index, None)
+    
+    def _release(self):
+        while self.next_index in self.pending:
+            item = self.pending.pop(self.next_index)
+            self.next_index += 1
+            if item is not None:
+                self.emit(item)
+
+
+class Manifest:
+    """Append-only JSON-lines journal of finished questions
+    
+    One line per completed question; a later line for the same index
+    replaces an earlier one. Each line is flushed as it is written, so the
+    journal is usable after a crash at any point.
+    """
+    
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        
+    def records(self):
+        """Every record in the journal, oldest first"""
+        if not self.path.exists():
+            return []
+        records = []
+        for line in self.path.read_text(encoding="utf-8").splitlines():
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue  # Torn last line from a crash
+        return records
+    
+    def latest(self):
+        """Newest record for each question index"""
+        return {record['index']: record for record in self.records() if 'index' in record}
+    
+    def record(self, entry):
+        """Append one record"""
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+    
+    def reset(self):
+        """Forget everything (start the week from scratch)"""
+        if self.path.exists():
+            self.path.unlink()
+
+
+class FlagIndex:
+    """Persistent record of every flag issued, across all students and weeks
+    
+    Flags are the primary key of a SQLite table, so checking one is a single
+    index lookup even with millions of rows, and claims are batched into one
+    transaction. Each flag remembers its owner (student/week/kind/index):
+    a seeded rerun reissuing a question to the same owner is not a
+    collision. Safe to share between threads and processes.
+    """
+    
+    def __init__(self, path="flag_index.sqlite"):
+        import sqlite3
+        
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")  # Readers don't block the batch writers
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA cache_size=-65536")  # 64 MB of pages keeps inserts fast at millions of flags
+        self.db.execute("CREATE TABLE IF NOT EXISTS flags (flag TEXT PRIMARY KEY, owner TEXT NOT NULL) WITHOUT ROWID")
+        self._lock = threading.Lock()
+        
+    @staticmethod
+    def owner(student_id, week, kind, index):
+        """Owner key for one question"""
+        return f"{student_id}/week_{week}/{kind}/{index}"
+    
+    def __contains__(self, flag):
+        with self._lock:
+            return self.db.execute("SELECT 1 FROM flags WHERE flag = ?", (flag,)).fetchone() is not None
+    
+    def __len__(self):
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM flags").fetchone()[0]
+    
+    def claim(self, flag, owner):
+        """Reserve flag for owner; False if another question already holds it"""
+        return not self.claim_many([(flag, owner)])
+    
+    def claim_many(self, claims):
+        """Reserve (flag, owner) pairs in one transaction; returns the pairs that collided"""
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.execute("CREATE TEMP TABLE IF NOT EXISTS batch (seq INTEGER PRIMARY KEY, flag TEXT, owner TEXT)")
+                self.db.execute("DELETE FROM temp.batch")
+                self.db.executemany("INSERT INTO temp.batch (flag, owner) VALUES (?, ?)", claims)
+                self.db.execute("INSERT OR IGNORE INTO flags (flag, owner) SELECT flag, owner FROM temp.batch ORDER BY seq")
+                collided = self.db.execute(
+                    "SELECT b.flag, b.owner FROM temp.batch b JOIN flags f ON f.flag = b.flag "
+                    "WHERE f.owner != b.owner ORDER BY b.seq"
+                ).fetchall()
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        return collided
+    
+    def reassign(self, moves):
+        """Hand (flag, new_owner) pairs to their new owners in one transaction (pooled questions)"""
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.executemany("UPDATE flags SET owner = ? WHERE flag = ?",
+                                    [(owner, flag) for flag, owner in moves])
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+    
+    def import_sheet(self, path, chunk_size=50000):
+        """Claim every flag in a generated spreadsheet; returns (rows read, collisions)"""
+        coordinates = sheet_coordinates(path)
+        rows = read_sheet_rows(path)
+        read = 0
+        collided = []
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            claims = []
+            for row_num, row in enumerate(chunk, read + 2):  # Row 1 is the header
+                challenge = str(row.get('Challenge-Name') or "")
+                number = re.search(r"(\d+)$", challenge)
+                if coordinates and number:
+                    owner = self.owner(*coordinates, int(number.group(1)))
+                else:
+                    owner = f"{Path(path).resolve()}#{row_num}"
+                claims.append((str(row['Flag']), owner))
+            collided.extend(self.claim_many(claims))
+            read += len(chunk)
+        return read, collided
+    
+    def close(self):
+        """Close the database"""
+        self.db.close()
+
+
+def claim_unique_flags(flag_index, items, owner, redraw, max_attempts=20):
+    """Claim every item's flag, redrawing the ones another question already holds
+    
+    owner(item) gives the item's owner key and redraw(item, attempt) a new
+    flag for it; items are updated in place.
+    """
+    pending = items
+    for attempt in range(1, max_attempts + 1):
+        collided = set(flag_index.claim_many([(item['flag'], owner(item)) for item in pending]))
+        pending = [item for item in pending if (item['flag'], owner(item)) in collided]
+        if not pending:
+            return items
+        for item in pending:
+            instrumentation.event("flag_collision", flag=item['flag'], owner=owner(item))
+            item['flag'] = redraw(item, attempt)
+    raise RuntimeError(f"could not find unused flags for {len(pending)} questions")
+
+
+# Spreadsheet columns, in the order the hackathon platform expects
+STEG_COLUMNS = ['Challenge-Name', 'File-Name', 'Flag', 'Method', 'Value', 'Verified']
+ENCODING_COLUMNS = ['Challenge-Name', 'Flag', 'Method', 'Cipher', 'Value', 'Points']
+
+
+class RowSink:
+    """Spreadsheet writer that takes rows one at a time as they are produced
+    
+    Rows go to a hidden .<name>.partial file (tmp_path), which close()
+    renames to path; a sheet at path is therefore always complete. Use as
+    a context manager: leaving the block with an exception calls abort()
+    instead, so a failed run never leaves a sheet that looks finished.
+    With staged=False rows are written to path directly.
+    """
+    
+    def __init__(self, path, columns, staged=True):
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(f".{self.path.name}.partial") if staged else self.path
+        self.columns = columns
+        self.rows_written = 0
+        self.closed = False
+        
+    def write(self, row):
+        """Append one row (a dict keyed by column name)"""
+        raise NotImplementedError
+    
+    def finish(self):
+        """Flush and close tmp_path (subclasses)"""
+    
+    def close(self):
+        """Finish the file and move it into place"""
+        if self.closed:
+            return
+        self.closed = True
+        self.finish()
+        os.replace(self.tmp_path, self.path)
+    
+    def abort(self):
+        """Stop writing and throw the unfinished file away"""
+        if self.closed:
+            return
+        self.closed = True
+        self.finish()
+        self.tmp_path.unlink(missing_ok=True)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+            return
+        with instrumentation.span("sheet_close", path=str(self.path), rows=self.rows_written):
+            self.close()
+
+
+class CsvRowSink(RowSink):
+    """CSV output, flushed after every row"""
+    
+    def __init__(self, path, columns, staged=True):
+        super().__init__(path, columns, staged)
+        self.file = open(self.tmp_path, "w", newline="", encoding="utf-8")
+        self.writer = csv.DictWriter(self.file, fieldnames=columns)
+        self.writer.writeheader()
+        self.file.flush()
+        
+    def write(self, row):
+        """Append one row and flush it to disk"""
+        self.writer.writerow(row)
+        self.file.flush()
+        self.rows_written += 1
+    
+    def finish(self):
+        """Close the file"""
+        if not self.file.closed:
+            self.file.close()
+
+
+class XlsxRowSink(RowSink):
+    """Excel output via openpyxl's write-only mode (constant memory)
+    
+    An .xlsx file only becomes readable when it is closed, so rows are also
+    journaled to <name>.partial.csv as they arrive. The journal is removed
+    once the workbook is saved, and survives a crash or an aborted run.
+    """
+    
+    def __init__(self, path, columns):
+        super().__init__(path, columns)
+        from openpyxl import Workbook
+        
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet()
+        self.sheet.append(columns)
+        self.journal = CsvRowSink(self.path.with_suffix(".partial.csv"), columns, staged=False)
+        
+    def write(self, row):
+        """Append one row"""
+        self.sheet.append([row.get(column) for column in self.columns])
+        self.journal.write(row)
+        self.rows_written += 1
+    
+    def close(self):
+        """Save the workbook and drop the journal"""
+        if self.closed:
+            return
+        self.closed = True
+        self.workbook.save(self.tmp_path)
+        os.replace(self.tmp_path, self.path)
+        self.journal.abort()
+    
+    def abort(self):
+        """Drop the workbook; the journal keeps the rows written so far"""
+        if self.closed:
+            return
+        self.closed = True
+        self.sheet.close()
+        self.journal.close()
+
+
+class ParquetRowSink(RowSink):
+    """Parquet output (needs pyarrow), written in row groups of `batch_size` rows"""
+    
+    def __init__(self, path, columns, batch_size=10000):
+        super().__init__(path, columns)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet output needs pyarrow: pip install pyarrow")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.batch_size = batch_size
+        self.batch = []
+        self.writer = None
+        
+    def write(self, row):
+        """Buffer one row; a full batch is written out as a row group"""
+        self.batch.append(row)
+        self.rows_written += 1
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+    
+    def flush(self):
+        """Write buffered rows as one row group"""
+        if not self.batch:
+            return
+        columns = {column: [row.get(column) for row in self.batch] for column in self.columns}
+        if self.writer is None:
+            table = self.pa.table(columns)
+            self.writer = self.pq.ParquetWriter(self.tmp_path, table.schema)
+        else:
+            table = self.pa.table(columns, schema=self.writer.schema)
+        self.writer.write_table(table)
+        self.batch = []
+    
+    def close(self):
+        """Write the last row group and move the file into place"""
+        if not self.closed:
+            self.flush()
+            if self.writer is None:
+                self.batch = [{}]
+                self.flush()
+        super().close()
+    
+    def finish(self):
+        """Write the file footer"""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+ROW_SINKS = {
+    "xlsx": XlsxRowSink,
+    "csv": CsvRowSink,
+    "parquet": ParquetRowSink,
+}
+
+
+def open_row_sink(path, columns):
+    """Open a row sink for path, picking the format from its extension"""
+    fmt = Path(path).suffix.lstrip(".")
+    if fmt not in ROW_SINKS:
+        raise ValueError(f"Unknown spreadsheet format: {fmt} (choose from {', '.join(ROW_SINKS)})")
+    return ROW_SINKS[fmt](path, columns)
+
+
+def read_sheet_rows(path):
+    """Yield the rows (dicts) of an .xlsx / .csv / .parquet sheet, streaming"""
+    path = Path(path)
+    if path.suffix == ".csv":
+        with open(path, newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f)
+    elif path.suffix == ".parquet":
+        import pyarrow.parquet
+        
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches():
+            yield from batch.to_pylist()
+    else:
+        from openpyxl import load_workbook
+        
+        workbook = load_workbook(path, read_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, None) or ()
+            for values in rows:
+                yield dict(zip(header, values))
+        finally:
+            workbook.close()
+
+
+def sheet_coordinates(path):
+    """(student, week, kind) of a generated sheet such as week_3/encodings/12345_encodings.xlsx"""
+    path = Path(path)
+    name = re.fullmatch(r"(.+)_(encodings|stegs)", path.stem)
+    week = re.fullmatch(r"week_(\d+)", path.parent.parent.name)
+    if not name or not week:
+        return None
+    kind = "encoding" if name.group(2) == "encodings" else "steg"
+    return name.group(1), int(week.group(1)), kind
+
+
+# Bundle format -> archive file extension
+BUNDLE_FORMATS = {"zip": ".zip", "tar": ".tar", "tar.gz": ".tar.gz"}
+
+# Already compressed: stored as-is in zips, deflating them again only costs CPU
+STORED_SUFFIXES = {".jpg", ".jpeg", ".png", ".xlsx", ".parquet"}
+
+
+class UploadBundle:
+    """One upload archive (zip, tar or tar.gz) per student-week, filled during generation
+    
+    add() queues a finished file and returns at once; a background writer
+    streams it into the archive while generation carries on. The archive is
+    built under a hidden .partial name and only renamed into place by
+    close(), so a crashed run never leaves a bundle that looks complete.
+    """
+    
+    def __init__(self, path, compresslevel=6):
+        self.path = Path(path)
+        self.format = next((fmt for fmt, ext in BUNDLE_FORMATS.items() if self.path.name.endswith(ext)), None)
+        if self.format is None:
+            raise ValueError(f"Unknown bundle format: {self.path.name} (choose from {', '.join(BUNDLE_FORMATS)})")
+        
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.tmp = self.path.with_name(f".{self.path.name}.partial")
+        self.compresslevel = compresslevel
+        if self.format == "zip":
+            import zipfile
+            
+            self.archive = zipfile.ZipFile(self.tmp, "w")
+        elif self.format == "tar.gz":
+            import tarfile
+            
+            self.archive = tarfile.open(self.tmp, "w:gz", compresslevel=compresslevel)
+        else:
+            import tarfile
+            
+            self.archive = tarfile.open(self.tmp, "w")
+        
+        # One writer thread: archive members must be written one after another
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bundle")
+        self.pending = []
+        self.names = set()
+        self._lock = threading.Lock()
+    
+    def add(self, path, arcname):
+        """Queue a file for the archive under arcname (each name is added once)"""
+        with self._lock:
+            if arcname in self.names:
+                return
+            self.names.add(arcname)
+            self.pending.append(self.writer.submit(self._write, Path(path), arcname))
+    
+    def _write(self, path, arcname):
+        with instrumentation.span("bundle_write", path=str(path)) as span:
+            if self.format == "zip":
+                import zipfile
+                
+                info = zipfile.ZipInfo.from_file(path, arcname)
+                stored = path.suffix.lower() in STORED_SUFFIXES
+                info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+                self.archive.writestr(info, path.read_bytes(), compresslevel=self.compresslevel)
+            else:
+                self.archive.add(path, arcname)
+            span['bytes'] = path.stat().st_size
+    
+    def close(self):
+        """Finish the archive and move it into place; returns its path"""
+        self.writer.shutdown(wait=True)
+        errors = [future.exception() for future in self.pending if future.exception()]
+        self.archive.close()
+        if errors:
+            self.tmp.unlink(missing_ok=True)
+            raise errors[0]
+        os.replace(self.tmp, self.path)
+        return self.path
+    
+    def abort(self):
+        """Throw the unfinished archive away"""
+        self.writer.shutdown(wait=True)
+        self.archive.close()
+        self.tmp.unlink(missing_ok=True)
+
+
+class SteghideBackend:
+    """Interface for embed/extract engines
+    
+    A backend must produce and read files in the steghide 0.5.1 format with an
+    empty passphrase, so Futureboy can decode them. Both methods must be safe
+    to call from several threads at once.
+    """
+    
+    name = "base"
+    
+    def embed(self, cover_image, flag, output_image, timeout=None):
+        """Hide flag in cover_image, write output_image; return its path or None
+        
+        timeout (seconds) is a hint; backends that can't be interrupted ignore it.
+        """
+        raise NotImplementedError
+    
+    def extract(self, steg_image, timeout=None):
+        """Return the text hidden in steg_image, or None if nothing could be extracted"""
+        raise NotImplementedError
+
+
+@contextlib.contextmanager
+def input_file(data):
+    """Expose a path or in-memory bytes to a child process as a file path
+    
+    Yields (path, fds_to_pass). Bytes go into an anonymous memfd on Linux,
+    so nothing touches the (possibly network-mounted) output volume; other
+    platforms fall back to a private temp file that is removed afterwards.
+    """
+    if isinstance(data, (str, Path)):
+        yield str(data), ()
+        return
+    
+    if hasattr(os, "memfd_create"):
+        fd = os.memfd_create("steghide-input")
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            yield f"/dev/fd/{fd}", (fd,)
+        finally:
+            os.close(fd)
+        return
+    
+    tmp = tempfile.NamedTemporaryFile(suffix=".jpg", delete=False)
+    try:
+        tmp.write(data)
+        tmp.close()
+        yield tmp.name, ()
+    finally:
+        os.unlink(tmp.name)
+
+
+class SubprocessSteghide(SteghideBackend):
+    """Runs the real steghide executable for every embed/extract
+    
+    The flag is piped in on stdin and extracted data comes back on stdout,
+    so the only file steghide writes is the stegged image itself.
+    """
+    
+    name = "subprocess"
+    
+    def __init__(self, steghide_path, timeout=10):
+        self.steghide_path = steghide_path
+        self.timeout = timeout
+        
+    def embed(self, cover_image, flag, output_image, timeout=None):
+        """Embed flag using steghide (no password)
+        
+        cover_image may be a path or the cover's JPEG bytes.
+        """
+        timeout = timeout or self.timeout
+        with instrumentation.span("steghide_embed") as span:
+            if isinstance(cover_image, bytes):
+                span['bytes'] = len(cover_image)
+            try:
+                with input_file(cover_image) as (cover_path, fds):
+                    # Run steghide embed command
+                    # "-ef -" reads the flag from stdin; -p "" sets the empty password
+                    cmd = [
+                        str(self.steghide_path),
+                        "embed",
+                        "-ef", "-",
+                        "-cf", cover_path,
+                        "-sf", str(output_image),
+                        "-p", "",  # Empty password explicitly
+                        "-f"  # Force overwrite
+                    ]
+                    
+                    result = subprocess.run(
+                        cmd,
+                        capture_output=True,
+                        timeout=timeout,
+                        input=flag.encode('utf-8'),
+                        pass_fds=fds
+                    )
+                
+                span['returncode'] = result.returncode
+                if result.returncode == 0 and Path(output_image).exists():
+                    return output_image
+                else:
+                    span['ok'] = False
+                    span['error'] = result.stderr.decode(errors='replace').strip()[:200] or "no output image"
+                    # Try to print actual error
+                    if result.stderr:
+                        print(f"\nSteghide stderr: {result.stderr.decode(errors='replace')[:100]}")
+                    if result.stdout:
+                        print(f"Steghide stdout: {result.stdout.decode(errors='replace')[:100]}")
+                    return None
+                    
+            except subprocess.TimeoutExpired:
+                span['ok'] = False
+                span['error'] = f"timeout after {timeout:.1f}s"
+                print("(timeout)", end=" ")
+                return None
+            except Exception as e:
+                span['ok'] = False
+                span['error'] = str(e)
+                print(f"Error: {e}")
+                return None
+    
+    def extract(self, steg_image, timeout=None):
+        """Extract the hidden flag using steghide
+        
+        steg_image may be a path or the image's bytes.
+        """
+        timeout = timeout or self.timeout
+        with instrumentation.span("steghide_extract") as span:
+            try:
+                with input_file(steg_image) as (steg_path, fds):
+                    # "-xf -" writes the extracted data to stdout
+                    cmd = [
+                        str(self.steghide_path),
+                        "extract",
+                        "-sf", steg_path,
+                        "-xf", "-",
+                        "-p", "",  # Empty password
+                        "-f"  # Force overwrite
+                    ]
+                    
+                    result = subprocess.run(
+                        cmd,
+                        capture_output=True,
+                        timeout=timeout,
+                        input=b"",  # Send empty input
+                        pass_fds=fds
+                    )
+                
+                span['returncode'] = result.returncode
+                if result.returncode == 0:
+                    return result.stdout.decode('utf-8').strip()
+                span['ok'] = False
+                span['error'] = result.stderr.decode(errors='replace').strip()[:200]
+                return None
+                
+            except subprocess.TimeoutExpired:
+                span['ok'] = False
+                span['error'] = f"timeout after {timeout:.1f}s"
+                return None
+            except Exception as e:
+                span['ok'] = False
+                span['error'] = str(e)
+                return None
+
+
+def find_steghide():
+    """Find steghide executable"""
+    # Check common folder locations
+    possible_paths = [
+        Path("steghide") / "steghide.exe",  # Most common: extracted steghide folder
+        Path("steghide-0.5.1-win32") / "steghide.exe",  # If user renamed it
+        Path("steghide.exe"),  # Current directory
+    ]
+    
+    for path in possible_paths:
+        if path.exists():
+            print(f"Found steghide at: {path.parent if path.parent.name != '.' else 'current directory'}")
+            return path.absolute()
+    
+    # Check if in PATH
+    try:
+        result = subprocess.run(["steghide", "--version"], 
+                              capture_output=True, 
+                              text=True,
+                              timeout=5)
+        if result.returncode == 0:
+            print("Found steghide in system PATH")
+            return "steghide"
+    except:
+        pass
+    
+    print("\n" + "="*70)
+    print("ERROR: steghide.exe not found!")
+    print("="*70)
+    print("\nPlease download and extract steghide:")
+    print("1. Go to: https://sourceforge.net/projects/steghide/files/steghide/0.5.1/")
+    print("2. Download: steghide-0.5.1-win32.zip")
+    print("3. Extract the ZIP file")
+    print("4. Inside you'll find a 'steghide' folder - copy that entire folder")
+    print("   to the same directory as this script")
+    print("\nYour folder structure should be:")
+    print("  your_folder/")
+    print("    ├── steghide/              <- The extracted folder")
+    print("    │   ├── steghide.exe")
+    print("    │   └── *.dll files")
+    print("    └── question_generator_steghide.py")
+    print("\nOr install via Chocolatey: choco install steghide")
+    print("="*70 + "\n")
+    raise FileNotFoundError("steghide.exe not found")
+
+
+def subprocess_backend():
+    """Locate the steghide executable and wrap it in a backend"""
+    return SubprocessSteghide(find_steghide())
+
+
+# Backend name -> factory(). Register alternative engines here. Only the
+# subprocess backend exists so far; an in-process steghide 0.5.1 engine
+# would be registered next to it and cross-tested against the binary.
+STEGHIDE_BACKENDS = {
+    "subprocess": subprocess_backend,
+}
+
+
+def make_steghide_backend(name):
+    """Build the named steghide backend"""
+    if name not in STEGHIDE_BACKENDS:
+        raise ValueError(f"Unknown steghide backend: {name} (choose from {', '.join(STEGHIDE_BACKENDS)})")
+    return STEGHIDE_BACKENDS[name]()
+
+
+class LatencyTracker:
+    """Sliding window of observed latencies, for adaptive timeouts and hedging
+    
+    Until min_samples calls have been seen the timeout is `initial`; after
+    that it is `multiplier` times the p95, clamped to [floor, ceiling].
+    """
+    
+    def __init__(self, initial=10.0, floor=2.0, ceiling=60.0, multiplier=4.0, window=256, min_samples=8):
+        self.initial = initial
+        self.floor = floor
+        self.ceiling = ceiling
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self.samples = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+        
+    def record(self, seconds):
+        """Add one observation (a timed-out call counts as its timeout)"""
+        with self._lock:
+            self.samples.append(seconds)
+    
+    def percentile(self, pct):
+        """Nearest-rank percentile of the window, or None with too few samples"""
+        with self._lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered), max(1, round(pct / 100 * len(ordered)))) - 1]
+    
+    def timeout(self):
+        """Timeout for the next call"""
+        p95 = self.percentile(95)
+        if p95 is None:
+            return self.initial
+        return min(self.ceiling, max(self.floor, self.multiplier * p95))
+    
+    def hedge_delay(self):
+        """How long to wait before launching a duplicate (None: don't hedge yet)"""
+        return self.percentile(95)
+
+
+class SteghideScheduler:
+    """Runs a backend's embeds and extracts with adaptive timeouts and hedging
+    
+    Each call gets a timeout derived from recent latencies. A call still
+    running at the p95 latency gets a speculative duplicate, and the first
+    good result wins (at most max_hedges duplicates run at once). Embed
+    attempts write to private temp files; only the winner is moved into
+    place.
+    """
+    
+    def __init__(self, backend, workers=8, max_hedges=2):
+        self.backend = backend
+        self.latency = {"embed": LatencyTracker(), "extract": LatencyTracker()}
+        self.pool = ThreadPoolExecutor(max_workers=max(2, workers + max_hedges),
+                                       thread_name_prefix="steghide")
+        self.hedges = threading.BoundedSemaphore(max_hedges)
+        self.hedged = 0
+        
+    def _timed(self, op, call, attempt):
+        """Run one attempt, feeding its latency back into the tracker"""
+        tracker = self.latency[op]
+        timeout = tracker.timeout()
+        start = time.perf_counter()
+        result = call(attempt, timeout)
+        elapsed = time.perf_counter() - start
+        if result or elapsed >= timeout * 0.9:  # Quick failures say nothing about latency
+            tracker.record(elapsed)
+        return result
+    
+    def run(self, op, call):
+        """call(attempt, timeout) -> result or None; returns the first good result (or None)"""
+        from concurrent.futures import FIRST_COMPLETED, wait
+        
+        futures = {self.pool.submit(self._timed, op, call, 0)}
+        delay = self.latency[op].hedge_delay()
+        hedging = False
+        
+        if delay is not None:
+            done, _ = wait(futures, timeout=delay)
+            if not done and self.hedges.acquire(blocking=False):
+                hedging = True
+                self.hedged += 1
+                instrumentation.event("steghide_hedge", op=op, after=delay)
+                futures.add(self.pool.submit(self._timed, op, call, 1))
+        
+        try:
+            while futures:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        result = future.result()
+                    except Exception:
+                        result = None
+                    if result:
+                        return result
+            return None
+        finally:
+            if hedging:
+                self.hedges.release()
+    
+    def embed(self, cover_image, flag, output_image):
+        """Embed with a timeout and hedging; returns output_image or None"""
+        output_image = Path(output_image)
+        won = []
+        lock = threading.Lock()
+        
+        def attempt_embed(attempt, timeout):
+            # Each attempt writes its own file; the first to succeed moves it into place
+            tmp = output_image.with_name(f".{output_image.stem}.try{attempt}{output_image.suffix}")
+            ok = self.backend.embed(cover_image, flag, tmp, timeout=timeout)
+            with lock:
+                if ok and not won:
+                    os.replace(tmp, output_image)
+                    won.append(attempt)
+                    return output_image
+            tmp.unlink(missing_ok=True)  # Failed, or lost the race
+            return None
+        
+        return self.run("embed", attempt_embed)
+    
+    def extract(self, steg_image):
+        """Extract with a timeout and hedging; returns the hidden text or None"""
+        return self.run("extract", lambda attempt, timeout: self.backend.extract(steg_image, timeout=timeout))
+
+
 class SteghideGenerator:
     """Generates steganography questions using actual steghide"""
     
-    def __init__(self, output_dir="steg_output", student_id="student"):
+    def __init__(self, output_dir="steg_output", student_id="student",
+                 fetch_workers=4, embed_workers=None, verify_workers=None,
+                 image_source=None, cover_cache=None, backend="subprocess",
+                 keep_originals=True, sheet_format="xlsx", plan_covers=True, seed=None, week=None,
+                 flag_index=None, bundle=None, covers=None):
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
         self.student_id = student_id
+        
+        # Flags come from per-question streams of this master seed (see question_rng)
+        self.seed = new_seed() if seed is None else seed
+        self.week = week
+        
+        # Optional FlagIndex shared by every student and week, to keep flags unique
+        self.flag_index = flag_index
+        
         self.images_dir = self.output_dir / "original_images"
         self.stegged_dir = self.output_dir / "stegged_images"
-        self.images_dir.mkdir(exist_ok=True)
         self.stegged_dir.mkdir(exist_ok=True)
         
-        # Check if steghide is available
-        self.steghide_path = self.find_steghide()
+        # Copy each cover into original_images/ for reference; when False the
+        # cover stays in memory (or the cache) and only stegged images are written
+        self.keep_originals = keep_originals
+        if keep_originals:
+            self.images_dir.mkdir(exist_ok=True)
         
-    def find_steghide(self):
-        """Find steghide executable"""
-        # Check common folder locations
-        possible_paths = [
-            Path("steghide") / "steghide.exe",  # Most common: extracted steghide folder
-            Path("steghide-0.5.1-win32") / "steghide.exe",  # If user renamed it
-            Path("steghide.exe"),  # Current directory
-        ]
+        # Shrink each cover to the smallest size with room for the flag (see plan_cover)
+        self.plan_covers = plan_covers
         
-        for path in possible_paths:
-            if path.exists():
-                print(f"Found steghide at: {path.parent if path.parent.name != '.' else 'current directory'}")
-                return path.absolute()
+        # Optional UploadBundle that verified images are streamed into as they finish
+        self.bundle = bundle
         
-        # Check if in PATH
-        try:
-            result = subprocess.run(["steghide", "--version"], 
-                                  capture_output=True, 
-                                  text=True,
-                                  timeout=5)
-            if result.returncode == 0:
-                print("Found steghide in system PATH")
-                return "steghide"
-        except:
-            pass
+        # Spreadsheet format: xlsx, csv or parquet (see ROW_SINKS)
+        self.sheet_format = sheet_format
+        
+        # Worker pool sizes for pipelined mode (steghide is CPU-bound, so default to cores)
+        cores = os.cpu_count() or 2
+        self.fetch_workers = fetch_workers
+        self.embed_workers = embed_workers or cores
+        self.verify_workers = verify_workers or cores
+        
+        # Where cover images come from (cataas by default)
+        self.image_source = image_source or CataasSource(pool_size=max(fetch_workers, 1))
         
-        print("\n" + "="*70)
-        print("ERROR: steghide.exe not found!")
-        print("="*70)
-        print("\nPlease download and extract steghide:")
-        print("1. Go to: https://sourceforge.net/projects/steghide/files/steghide/0.5.1/")
-        print("2. Download: steghide-0.5.1-win32.zip")
-        print("3. Extract the ZIP file")
-        print("4. Inside you'll find a 'steghide' folder - copy that entire folder")
-        print("   to the same directory as this script")
-        print("\nYour folder structure should be:")
-        print("  your_folder/")
-        print("    ├── steghide/              <- The extracted folder")
-        print("    │   ├── steghide.exe")
-        print("    │   └── *.dll files")
-        print("    └── question_generator_steghide.py")
-        print("\nOr install via Chocolatey: choco install steghide")
-        print("="*70 + "\n")
-        raise FileNotFoundError("steghide.exe not found")
-        
-    def generate_flag(self, theme_prefix="CAT", length=12):
-        """Generate a random flag"""
+        # Optional shared pool of covers; when warm, no network on the critical path
+        self.cover_cache = cover_cache
+        
+        # Cover paths set aside for this run (batch mode), used before anything else
+        self.reserved = collections.deque(Path(path) for path in covers or ())
+        
+        # Covers rendered so far per question index (indexed sources)
+        self.cover_draws = collections.Counter()
+        
+        # Embed/extract engine: a backend name from STEGHIDE_BACKENDS or an instance
+        if isinstance(backend, str):
+            backend = make_steghide_backend(backend)
+        self.backend = backend
+        
+        # Adaptive timeouts and hedged duplicates around every embed/extract
+        self.scheduler = SteghideScheduler(backend, workers=self.embed_workers + self.verify_workers)
+        
+        # Wall-clock deadline for the current run (None: no limit)
+        self.deadline = None
+        
+    def generate_flag(self, theme_prefix="CAT", length=12, rng=None):
+        """Generate a random flag (from rng if given, else the global random module)"""
         chars = string.ascii_uppercase + string.ascii_lowercase + string.digits
-        random_part = ''.join(random.choices(chars, k=length))
+        random_part = ''.join((rng or random).choices(chars, k=length))
         return f"CAHSI-{theme_prefix}{random_part}"
     
-    def fetch_cat_image(self, filename):
-        """Fetch cat image from API and save as JPEG"""
-        max_attempts = 10
+    def question_rng(self, index, attempt=0):
+        """Random stream for steganography question number index"""
+        return question_rng(self.seed, self.student_id, self.week, "steg", index, attempt)
+    
+    def claim_flags(self, jobs, theme):
+        """Register the jobs' flags in the flag index, redrawing any already taken"""
+        if self.flag_index is None:
+            return jobs
+        return claim_unique_flags(
+            self.flag_index, jobs,
+            owner=lambda job: FlagIndex.owner(self.student_id, self.week, "steg", job['index']),
+            redraw=lambda job, attempt: self.generate_flag(theme[:3].upper(), 12,
+                                                           self.question_rng(job['index'], attempt)),
+        )
+    
+    def get_cover(self, index=None, max_repeats=5):
+        """Get a cover image: a cached path, or freshly fetched JPEG bytes (None on failure)
+        
+        An indexed source (procedural) renders question index's own cover,
+        and a fresh one each time the question is retried. A download that
+        turns out to be a cover the cache already issued is fetched again,
+        up to max_repeats times, before it is used anyway.
+        """
+        if self.image_source.indexed and index is not None:
+            redraw = self.cover_draws[index]
+            self.cover_draws[index] += 1
+            return self.image_source.render(index, redraw)
+        
+        try:
+            return self.reserved.popleft()
+        except IndexError:
+            pass
         
-        for attempt in range(max_attempts):
+        if self.cover_cache:
+            cached = self.cover_cache.take()
+            if cached:
+                return cached
+        
+        for attempt in range(max_repeats + 1):
             try:
-                response = requests.get("https://cataas.com/cat", timeout=15)
-                response.raise_for_status()
-                
-                img = Image.open(io.BytesIO(response.content))
-                
-                # Convert to RGB for JPEG
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-                    if img.mode == 'P':
-                        img = img.convert('RGBA')
-                    if img.mode in ('RGBA', 'LA'):
-                        rgb_img.paste(img, mask=img.split()[-1])
-                    else:
-                        rgb_img.paste(img)
-                    img = rgb_img
-                elif img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Save as JPEG (steghide supports JPEG)
-                filepath = self.images_dir / filename
-                img.save(filepath, 'JPEG', quality=95)
-                
-                # Resize if too large
-                if filepath.stat().st_size > 2 * 1024 * 1024:
-                    img.thumbnail((1920, 1920), Image.Resampling.LANCZOS)
-                    img.save(filepath, 'JPEG', quality=90)
-                
-                return filepath
-                
-            except Exception as e:
-                if attempt < max_attempts - 1:
-                    time.sleep(2)
-                    continue
+                data = fetch_cover(self.image_source)
+            except FetchError as e:
                 print(f"✗ Failed to fetch image: {e}")
                 return None
-        
-        return None
+            if not self.cover_cache:
+                return data
+            
+            # Cold cache: keep the download for future runs
+            path = self.cover_cache.add(data, taken=True)
+            if path:
+                return path
+            instrumentation.event("cover_repeat", cover=hashlib.sha256(data).hexdigest())
+        return data
+    
+    def fetch_cat_image(self, filename):
+        """Get a cover image (cache first, then the image source) and save as JPEG"""
+        cover = self.get_cover()
+        if cover is None:
+            return None
+        return self.save_original(cover, filename)
+    
+    def save_original(self, cover, filename):
+        """Write a cover (cache path or JPEG bytes) to original_images/; returns its path"""
+        filepath = self.images_dir / filename
+        filepath.parent.mkdir(exist_ok=True)
+        with instrumentation.span("disk_write", path=str(filepath)) as span:
+            if isinstance(cover, Path):
+                shutil.copyfile(cover, filepath)
+            else:
+                filepath.write_bytes(cover)
+            span['bytes'] = filepath.stat().st_size
+        return filepath
     
     def steg_with_steghide(self, cover_image, flag, output_image):
-        """Embed flag using steghide (no password)"""
-        try:
-            # Create temp file with flag
-            flag_file = self.images_dir / "temp_flag.txt"
-            flag_file.write_text(flag, encoding='utf-8')
-            
-            # Run steghide embed command
-            # Use -p "" to explicitly set empty password
-            cmd = [
-                str(self.steghide_path),
-                "embed",
-                "-ef", str(flag_file),
-                "-cf", str(cover_image),
-                "-sf", str(output_image),
-                "-p", "",  # Empty password explicitly
-                "-f"  # Force overwrite
-            ]
+        """Embed flag using the steghide backend (no password)"""
+        return self.scheduler.embed(cover_image, flag, output_image)
+    
+    def verify_with_steghide(self, steg_image, expected_flag):
+        """Verify stegged image using the steghide backend"""
+        return self.scheduler.extract(steg_image) == expected_flag
+    
+    def question_names(self, i, theme):
+        """Challenge and file names for question number i"""
+        return {
+            'index': i,
+            'challenge_name': f"{theme}Steg{i:03d}",
+            'original_filename': f"{theme.lower()}_{i:03d}.jpg",
+            'stegged_filename': f"{theme.lower()}_{i:03d}_steg.jpg",
+        }
+    
+    def new_question(self, i, theme):
+        """Names and flag for question number i"""
+        job = self.question_names(i, theme)
+        job['flag'] = self.generate_flag(theme[:3].upper(), 12, self.question_rng(i))
+        return job
+    
+    def fetch_stage(self, job):
+        """Pipeline stage: download the cover image and size it for the flag"""
+        with instrumentation.question(job['challenge_name']), instrumentation.span("fetch") as span:
+            if self.deadline and time.time() > self.deadline:
+                span.update(ok=False, error="out of time")
+                return None
             
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=10,  # Reduced timeout
-                input=""  # Send empty input to stdin
-            )
+            cover = self.get_cover(job['index'])  # Path in the cache, or bytes in memory
+            if cover is None:
+                span.update(ok=False, error="no cover image")
+                return None
+            if isinstance(cover, Path):
+                job['cover_cached'] = cover.name  # Where the original lives when originals aren't kept
             
-            # Clean up temp file
-            if flag_file.exists():
-                flag_file.unlink()
+            if self.plan_covers:
+                data = cover.read_bytes() if isinstance(cover, Path) else cover
+                planned, job['cover_plan'] = plan_cover(data, len(job['flag'].encode('utf-8')))
+                if job['cover_plan']['resized']:
+                    cover = planned
             
-            if result.returncode == 0 and Path(output_image).exists():
-                return output_image
-            else:
-                # Try to print actual error
-                if result.stderr:
-                    print(f"\nSteghide stderr: {result.stderr[:100]}")
-                if result.stdout:
-                    print(f"Steghide stdout: {result.stdout[:100]}")
+            if self.keep_originals:
+                cover = self.save_original(cover, job['original_filename'])
+            job['cover'] = cover
+        
+        job['cover_sha256'] = hashlib.sha256(
+            cover.read_bytes() if isinstance(cover, Path) else cover
+        ).hexdigest()
+        return job
+    
+    def done_with_cover(self, job, used=True):
+        """Let the cache evict job's cover again, unless the manifest will point at it"""
+        if self.cover_cache and job.get('cover_cached') and (self.keep_originals or not used):
+            self.cover_cache.unhold(job['cover_cached'])
+    
+    def embed_stage(self, job):
+        """Pipeline stage: embed the flag with steghide"""
+        steg_path = self.stegged_dir / job['stegged_filename']
+        cover = job.pop('cover')  # Don't hold cover bytes past this stage
+        with instrumentation.question(job['challenge_name']), instrumentation.span("embed") as span:
+            embedded = self.steg_with_steghide(cover, job['flag'], steg_path)
+            self.done_with_cover(job, used=bool(embedded))
+            if not embedded:
+                span.update(ok=False, error="steghide embed failed")
                 return None
-                
-        except subprocess.TimeoutExpired:
-            print("(timeout)", end=" ")
-            if flag_file.exists():
-                flag_file.unlink()
-            return None
-        except Exception as e:
-            print(f"Error: {e}")
-            if flag_file.exists():
-                flag_file.unlink()
-            return None
+        job['steg_path'] = steg_path
+        return job
     
-    def verify_with_steghide(self, steg_image, expected_flag):
-        """Verify stegged image using steghide"""
-        try:
-            # Extract to temp file
-            extract_file = self.images_dir / "temp_extract.txt"
-            
-            cmd = [
-                str(self.steghide_path),
-                "extract",
-                "-sf", str(steg_image),
-                "-xf", str(extract_file),
-                "-p", "",  # Empty password
-                "-f"  # Force overwrite
-            ]
+    def verify_stage(self, job):
+        """Pipeline stage: extract the flag again and compare"""
+        with instrumentation.question(job['challenge_name']), instrumentation.span("verify") as span:
+            job['verified'] = self.verify_with_steghide(job['steg_path'], job['flag'])
+            if not job['verified']:
+                span.update(ok=False, error="extracted flag does not match")
+                self.done_with_cover(job, used=False)
+        return job
+    
+    def question_row(self, job):
+        """Spreadsheet row for a finished question"""
+        return {
+            'Challenge-Name': job['challenge_name'],
+            'File-Name': job['steg_path'].name,
+            'Flag': job['flag'],
+            'Method': 'steghide',
+            'Value': 1,
+            'Verified': '✓' if job['verified'] else '✗'
+        }
+    
+    def manifest_entry(self, job):
+        """Manifest record for a finished question"""
+        return {
+            'index': job['index'],
+            'challenge': job['challenge_name'],
+            'file': job['steg_path'].name,
+            'flag': job['flag'],
+            'cover_sha256': job.get('cover_sha256'),
+            'cover_plan': job.get('cover_plan'),
+            'cover_cached': job.get('cover_cached'),
+            'steg_sha256': hashlib.sha256(job['steg_path'].read_bytes()).hexdigest(),
+            'verified': bool(job['verified']),
+            'time': datetime.now().isoformat(timespec='seconds'),
+        }
+    
+    def resumable_questions(self, manifest, num_questions, theme):
+        """Rows for questions a previous run already finished and verified
+        
+        A record only counts if it belongs to this theme, was verified, and its
+        stegged image is still on disk unchanged.
+        """
+        finished = {}
+        for index, record in manifest.latest().items():
+            if index > num_questions or not record.get('verified'):
+                continue
+            if record.get('challenge') != self.question_names(index, theme)['challenge_name']:
+                continue
+            steg_path = self.stegged_dir / record['file']
+            if not steg_path.exists():
+                continue
+            if hashlib.sha256(steg_path.read_bytes()).hexdigest() != record.get('steg_sha256'):
+                continue
+            finished[index] = {
+                'Challenge-Name': record['challenge'],
+                'File-Name': record['file'],
+                'Flag': record['flag'],
+                'Method': 'steghide',
+                'Value': 1,
+                'Verified': '✓'
+            }
+        return finished
+    
+    def run_serial(self, jobs, num_questions, on_result, on_drop):
+        """Fetch, embed and verify one question at a time"""
+        progress = Progress(len(jobs))
+        for job in jobs:
+            print(f"Question {job['index']}/{num_questions}...", end=" ")
             
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=10,  # Reduced timeout
-                input=""  # Send empty input
-            )
+            # Download image
+            if not self.fetch_stage(job):
+                print("Failed to download")
+                on_drop("fetch", job)
+                continue
             
-            if result.returncode == 0 and extract_file.exists():
-                extracted_flag = extract_file.read_text(encoding='utf-8').strip()
-                if extract_file.exists():
-                    extract_file.unlink()
-                return extracted_flag == expected_flag
+            # Steg with steghide
+            if not self.embed_stage(job):
+                print("Failed to steg")
+                on_drop("embed", job)
+                continue
             
-            if extract_file.exists():
-                extract_file.unlink()
-            return False
+            # Verify
+            self.verify_stage(job)
             
-        except subprocess.TimeoutExpired:
-            return False
-        except Exception as e:
-            return False
+            print(f"{'✅' if job['verified'] else '⚠️'} ({progress.tick()})")
+            on_result(job)
     
-    def generate_questions(self, num_questions=25, theme="Cats"):
-        """Generate all steganography questions"""
-        questions = []
+    def run_pipelined(self, jobs, num_questions, on_result, on_drop):
+        """Run fetch, embed and verify as concurrent stages"""
+        pipeline = StagePipeline([
+            ("fetch", self.fetch_stage, self.fetch_workers),
+            ("embed", self.embed_stage, self.embed_workers),
+            ("verify", self.verify_stage, self.verify_workers),
+        ])
+        
+        done = []
+        progress = Progress(len(jobs))
+        
+        def report(job):
+            done.append(job)
+            status = "✅" if job['verified'] else "⚠️"
+            print(f"Question {job['index']}/{num_questions}... {status} ({len(done)} done, {progress.tick()})")
+            on_result(job)
+        
+        pipeline.run(jobs, on_result=report, on_drop=on_drop)
+        
+        if pipeline.failures["fetch"]:
+            print(f"Failed to download: {pipeline.failures['fetch']}")
+        if pipeline.failures["embed"]:
+            print(f"Failed to steg: {pipeline.failures['embed']}")
+    
+    def generate_questions(self, num_questions=25, theme="Cats", pipelined=False,
+                           resume=True, max_rounds=10, time_budget=None):
+        """Generate all steganography questions
         
+        Every finished question is journaled to manifest.jsonl in the output
+        folder. With resume=True a rerun keeps the verified questions from
+        earlier runs and only makes the missing ones. Questions that fail or
+        don't verify are retried with a fresh cover, round after round, until
+        all num_questions are verified - or max_rounds rounds or time_budget
+        seconds have been used up. Only verified questions reach the sheet.
+        """
         print(f"\n{'='*70}")
         print(f"GENERATING {num_questions} STEGANOGRAPHY QUESTIONS")
         print(f"Using: steghide (Futureboy-compatible!)")
+        if pipelined:
+            print(f"Workers: fetch={self.fetch_workers}, embed={self.embed_workers}, verify={self.verify_workers}")
         print(f"{'='*70}\n")
         
-        for i in range(1, num_questions + 1):
-            print(f"Question {i}/{num_questions}...", end=" ")
+        manifest = Manifest(self.output_dir / "manifest.jsonl")
+        if not resume:
+            manifest.reset()
+        finished = self.resumable_questions(manifest, num_questions, theme)
+        if finished:
+            print(f"Resuming: {len(finished)}/{num_questions} questions already done (manifest.jsonl)\n")
+        
+        run = self.run_pipelined if pipelined else self.run_serial
+        questions = []
+        self.deadline = time.time() + time_budget if time_budget else None
+        
+        # Rows stream into the spreadsheet, in question order, as questions finish
+        spreadsheet_path = self.output_dir / f"{self.student_id}_stegs.{self.sheet_format}"
+        with instrumentation.hooked(StageStats()) as stats, open_row_sink(spreadsheet_path, STEG_COLUMNS) as sink:
+            def write_row(row):
+                questions.append(row)
+                with instrumentation.span("sheet_write", question=row['Challenge-Name']):
+                    sink.write(row)
+                if self.bundle:
+                    self.bundle.add(self.stegged_dir / row['File-Name'],
+                                    f"{self.output_dir.name}/stegged_images/{row['File-Name']}")
             
-            challenge_name = f"{theme}Steg{i:03d}"
-            original_filename = f"{theme.lower()}_{i:03d}.jpg"
-            stegged_filename = f"{theme.lower()}_{i:03d}_steg.jpg"
-            flag = self.generate_flag(theme[:3].upper(), 12)
+            in_order = ReorderBuffer(write_row)
+            for index, row in finished.items():
+                in_order.add(index, row)
             
-            # Download image
-            image_path = self.fetch_cat_image(original_filename)
-            if not image_path:
-                print("Failed to download")
-                continue
+            pending = [i for i in range(1, num_questions + 1) if i not in finished]
+            for round_num in range(1, max_rounds + 1):
+                if not pending:
+                    break
+                if self.deadline and time.time() > self.deadline:
+                    print(f"\n⚠️  Time budget of {time_budget}s used up")
+                    break
+                if round_num > 1:
+                    print(f"\nBackfilling {len(pending)} questions (round {round_num}/{max_rounds})...\n")
+                
+                retry = []
+                retry_lock = threading.Lock()
+                
+                def on_result(job):
+                    manifest.record(self.manifest_entry(job))
+                    if job['verified']:
+                        in_order.add(job['index'], self.question_row(job))
+                    else:
+                        with retry_lock:
+                            retry.append(job['index'])
+                
+                def on_drop(stage, job):
+                    with retry_lock:
+                        retry.append(job['index'])
+                
+                jobs = self.claim_flags([self.new_question(i, theme) for i in pending], theme)
+                run(jobs, num_questions, on_result, on_drop)
+                pending = sorted(retry)
             
-            # Steg with steghide
-            steg_path = self.stegged_dir / stegged_filename
-            result = self.steg_with_steghide(image_path, flag, steg_path)
-            if not result:
-                print("Failed to steg")
+            # Out of rounds or time: these questions are left out, with no stray images
+            for index in pending:
+                in_order.skip(index)
+                (self.stegged_dir / self.question_names(index, theme)['stegged_filename']).unlink(missing_ok=True)
+        self.deadline = None
+        
+        import pandas as pd
+        
+        df = pd.DataFrame(questions, columns=STEG_COLUMNS)
+        
+        verified_count = len([q for q in questions if q['Verified'] == '✓'])
+        
+        print(f"\n{'='*70}")
+        print(f"✓ Generated {len(questions)}/{num_questions} questions")
+        print(f"✓ Verified: {verified_count}/{len(questions)}")
+        if pending:
+            print(f"⚠️  Missing: {len(pending)} questions could not be verified ({', '.join(map(str, pending))})")
+        if self.scheduler.hedged:
+            print(f"✓ Hedged steghide calls: {self.scheduler.hedged}")
+        print(f"✓ Spreadsheet: {spreadsheet_path}")
+        print(f"✓ Stegged images: {self.stegged_dir}")
+        print("\nStage timings:")
+        stats.print_report()
+        print(f"{'='*70}\n")
+        
+        return df
+
+
+STEG_REPORT_COLUMNS = ['Sheet', 'Challenge-Name', 'File-Name', 'Flag', 'Extracted', 'Status', 'Cached']
+
+
+class SteghideVerifier:
+    """Re-checks existing steganography output against its spreadsheets
+    
+    Every row's stegged image is extracted through a SteghideScheduler (the
+    same path verify_with_steghide takes during generation), many images at
+    once. Results are journaled to a JSON-lines cache keyed by the image's
+    sha256 and flag, so a re-audit only runs steghide on files that changed.
+    Stray images in stegged_images/ that no row mentions are reported too.
+    """
+    
+    def __init__(self, backend="subprocess", workers=None, cache="steg_verify_cache.jsonl"):
+        self.workers = workers or os.cpu_count() or 2
+        if isinstance(backend, str):
+            backend = make_steghide_backend(backend)
+        self.backend = backend
+        self.scheduler = SteghideScheduler(backend, workers=self.workers)
+        
+        # (sha256, flag) -> extracted text
+        self.cache = Manifest(cache) if cache else None
+        self.known = {}
+        if self.cache:
+            for record in self.cache.records():
+                self.known[(record.get('sha256'), record.get('flag'))] = record.get('extracted')
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def find_sheets(paths):
+        """Every *_stegs sheet under the given files or folders (week, cohort...)"""
+        sheets = []
+        for path in map(Path, paths):
+            if path.is_file():
+                sheets.append(path)
                 continue
+            for fmt in ROW_SINKS:
+                sheets.extend(path.rglob(f"*_stegs.{fmt}"))
+        return sorted(set(sheets))
+    
+    def check_image(self, steg_path, flag):
+        """(extracted text or None, cached?) for one stegged image"""
+        data = steg_path.read_bytes()
+        key = (hashlib.sha256(data).hexdigest(), flag)
+        with self._lock:
+            if key in self.known:
+                return self.known[key], True
+        
+        with instrumentation.question(steg_path.name), instrumentation.span("verify", path=str(steg_path)) as span:
+            extracted = self.scheduler.extract(data)
+            if extracted != flag:
+                span.update(ok=False, error="extracted flag does not match")
+        
+        if extracted is None:
+            return None, False  # May have been a timeout; try again next audit
+        with self._lock:
+            self.known[key] = extracted
+        if self.cache:
+            self.cache.record({'sha256': key[0], 'flag': flag, 'extracted': extracted,
+                               'time': datetime.now().isoformat(timespec='seconds')})
+        return extracted, False
+    
+    def check_row(self, sheet, row):
+        """Report row for one spreadsheet row"""
+        steg_path = sheet.parent / "stegged_images" / str(row.get('File-Name') or "")
+        flag = str(row.get('Flag') or "")
+        report = {
+            'Sheet': str(sheet),
+            'Challenge-Name': row.get('Challenge-Name'),
+            'File-Name': row.get('File-Name'),
+            'Flag': flag,
+            'Extracted': None,
+            'Status': 'ok',
+            'Cached': False,
+        }
+        if not steg_path.is_file():
+            report['Status'] = 'missing'
+            return report
+        
+        report['Extracted'], report['Cached'] = self.check_image(steg_path, flag)
+        if report['Extracted'] is None:
+            report['Status'] = 'unreadable'
+        elif report['Extracted'] != flag:
+            report['Status'] = 'mismatch'
+        return report
+    
+    def verify(self, paths):
+        """Check every sheet under paths; returns report rows, one per question or stray image"""
+        jobs = []
+        stray = []
+        for sheet in self.find_sheets(paths):
+            rows = list(read_sheet_rows(sheet))
+            jobs.extend((sheet, row) for row in rows)
             
-            # Verify
-            verified = self.verify_with_steghide(steg_path, flag)
-            
-            questions.append({
-                'Challenge-Name': challenge_name,
-                'File-Name': steg_path.name,
-                'Flag': flag,
-                'Method': 'steghide',
-                'Value': 1,
-                'Verified': '✓' if verified else '✗'
-            })
+            named = {str(row.get('File-Name')) for row in rows}
+            stegged_dir = sheet.parent / "stegged_images"
+            if stegged_dir.is_dir():
+                for path in sorted(stegged_dir.glob("*.jpg")):
+                    if path.name not in named and not path.name.startswith("."):
+                        stray.append({'Sheet': str(sheet), 'Challenge-Name': None, 'File-Name': path.name,
+                                      'Flag': None, 'Extracted': None, 'Status': 'extra', 'Cached': False})
+        
+        progress = Progress(len(jobs))
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            reports = []
+            for done, report in enumerate(pool.map(lambda job: self.check_row(*job), jobs), 1):
+                reports.append(report)
+                rate = progress.tick()
+                if done % 100 == 0 or done == len(jobs):
+                    print(f"\rChecked {done}/{len(jobs)} ({rate})", end="", flush=True)
+        if jobs:
+            print()
+        return reports + stray
+
+
+@functools.lru_cache(maxsize=None)
+def caesar_table(shift):
+    """str.translate table for a Caesar shift (letters only, case preserved)"""
+    shift %= 26
+    upper = string.ascii_uppercase
+    lower = string.ascii_lowercase
+    return str.maketrans(
+        upper + lower,
+        upper[shift:] + upper[:shift] + lower[shift:] + lower[:shift]
+    )
+
+
+# Atbash: A<->Z, B<->Y, ... (case preserved)
+ATBASH_TABLE = str.maketrans(
+    string.ascii_uppercase + string.ascii_lowercase,
+    string.ascii_uppercase[::-1] + string.ascii_lowercase[::-1]
+)
+
+
+def compose_tables(first, second):
+    """Single translate table equivalent to applying `first`, then `second`"""
+    composed = {}
+    for key in set(first) | set(second):
+        middle = first.get(key, key)
+        composed[key] = second.get(middle, middle)
+    return composed
+
+
+# Cipher registry: name -> {"table": translate table} for letter substitutions,
+# or {"encode": func} for steps that transform the whole string
+CIPHERS = {}
+
+
+def register_cipher(name, encode=None, decode=None, table=None):
+    """Add a cipher to the registry: a translate table, or an encode/decode pair"""
+    if (encode is None) == (table is None):
+        raise ValueError("register_cipher needs exactly one of encode= or table=")
+    if table is not None:
+        # Substitutions are always invertible: swap the table around
+        CIPHERS[name] = {"table": table, "inverse": {v: k for k, v in table.items()}}
+    else:
+        CIPHERS[name] = {"encode": encode, "decode": decode}
+
+
+for _shift in range(1, 26):
+    register_cipher(f"caesar{_shift}", table=caesar_table(_shift))
+register_cipher("rot13", table=caesar_table(13))
+register_cipher("atbash", table=ATBASH_TABLE)
+register_cipher("base64",
+                encode=lambda text: base64.b64encode(text.encode()).decode(),
+                decode=lambda text: base64.b64decode(text, validate=True).decode())
+register_cipher("reverse", encode=lambda text: text[::-1], decode=lambda text: text[::-1])
+register_cipher("hex",
+                encode=lambda text: text.encode().hex(),
+                decode=lambda text: bytes.fromhex(text).decode())
+
+
+def parse_chain(spec):
+    """Turn a chain spec like "base64|caesar7|reverse|hex" (or "a->b") into a tuple of cipher names"""
+    steps = tuple(step.strip() for step in spec.replace("->", "|").split("|") if step.strip())
+    if not steps:
+        raise ValueError(f"Empty cipher chain: {spec!r}")
+    for step in steps:
+        if step not in CIPHERS:
+            raise ValueError(f"Unknown cipher: {step} (known: {', '.join(sorted(CIPHERS))})")
+    return steps
+
+
+def format_chain(chain):
+    """Method string for a chain, as written to the spreadsheet"""
+    return "->".join(chain)
+
+
+# Difficulty tiers. Each tier gets `weight` share of the bank and is worth
+# `points`; its chains are either listed explicitly ("chains") or drawn at
+# random as `depth` steps from a cipher "pool".
+DEFAULT_TIERS = [
+    {"name": "single", "weight": 60, "points": 1,
+     "chains": ["base64", "caesar3", "caesar7", "caesar13", "rot13", "atbash", "reverse"]},
+    {"name": "double", "weight": 30, "points": 1,
+     "chains": ["base64|caesar3", "base64|caesar7", "base64|rot13"]},
+    {"name": "triple", "weight": 10, "points": 2,
+     "chains": ["base64|caesar3|rot13", "base64|caesar7|rot13", "base64|caesar13|rot13"]},
+]
+
+
+@functools.lru_cache(maxsize=None)
+def compile_chain(steps):
+    """Compile a tuple of step names into a tuple of ("table"|"func", op) passes"""
+    passes = []
+    for name in steps:
+        if name not in CIPHERS:
+            raise ValueError(f"Unknown cipher: {name}")
+        cipher = CIPHERS[name]
+        if "table" in cipher:
+            if passes and passes[-1][0] == "table":
+                passes[-1] = ("table", compose_tables(passes[-1][1], cipher["table"]))
+            else:
+                passes.append(("table", cipher["table"]))
+        else:
+            passes.append(("func", cipher["encode"]))
+    return tuple(passes)
+
+
+def chain_cancels(chain):
+    """True if some run of adjacent substitutions in chain undoes itself (caesar13|rot13)"""
+    for start in range(len(chain)):
+        for end in range(start + 2, len(chain) + 1):
+            passes = compile_chain(tuple(chain[start:end]))
+            if len(passes) == 1 and passes[0][0] == "table" and all(k == v for k, v in passes[0][1].items()):
+                return True
+    return False
+
+
+def translate_many(texts, table):
+    """str.translate every string in a list, with one C-level pass when possible
+    
+    The strings are joined with newlines and split again afterwards; if any
+    string contains a newline itself, each one is translated separately.
+    """
+    joined = "\n".join(texts)
+    if joined.count("\n") == len(texts) - 1:
+        parts = joined.translate(table).split("\n")
+        if len(parts) == len(texts):
+            return parts
+    return [text.translate(table) for text in texts]
+
+
+class CipherEngine:
+    """Compiles cipher chains into fused, table-driven passes
+    
+    Every substitution cipher (caesarN, rot13, atbash) is a str.translate
+    table, and runs of adjacent substitutions are folded into one table, so
+    base64->caesar3->rot13 is a base64 pass plus a single caesar16 pass.
+    Compiled chains are cached, and encode_many() pushes a whole list of
+    flags through each table with one translate() call.
+    """
+    
+    def compile(self, steps):
+        """Compile a tuple of step names into a tuple of ("table"|"func", op) passes"""
+        return compile_chain(tuple(steps))
+    
+    def encode(self, text, steps):
+        """Apply a chain of cipher steps to one string"""
+        for kind, op in self.compile(tuple(steps)):
+            text = text.translate(op) if kind == "table" else op(text)
+        return text
+    
+    def encode_many(self, texts, steps):
+        """Apply a chain of cipher steps to a whole list of strings at once"""
+        texts = list(texts)
+        if not texts:
+            return []
+        for kind, op in self.compile(tuple(steps)):
+            if kind == "table":
+                texts = translate_many(texts, op)  # One C-level pass over every string
+            else:
+                texts = [op(text) for text in texts]
+        return texts
+
+
+BASE64_PATTERN = re.compile(r"[A-Za-z0-9+/]+={0,2}")
+
+
+def looks_like_base64(text):
+    """True if text is valid base64 that decodes to printable ASCII"""
+    if len(text) < 8 or len(text) % 4 or not BASE64_PATTERN.fullmatch(text):
+        return False
+    try:
+        decoded = base64.b64decode(text, validate=True).decode('ascii')
+    except Exception:
+        return False
+    return decoded.isprintable()
+
+
+class EncodingVerifier:
+    """Bulk checker for encoding banks: every Value must decode back to its Flag
+    
+    Rows are grouped by Method, so each chain is inverted once for all of its
+    rows and substitution steps are a single translate() over the group.
+    A Value equal to its Flag counts as a failure. Besides failures it
+    reports ambiguous questions: chains that can't be told apart from
+    another chain in the bank (caesar13 vs rot13), and intermediate strings
+    that also decode as base64 when that isn't the next step.
+    """
+    
+    def __init__(self, engine=None):
+        self.engine = engine or CipherEngine()
+        
+    def load(self, source):
+        """Accept a DataFrame or a path to an .xlsx / .csv / .parquet bank"""
+        import pandas as pd
+        
+        if not isinstance(source, (str, Path)):
+            return source
+        path = Path(source)
+        if path.suffix == ".csv":
+            return pd.read_csv(path, dtype=str, keep_default_na=False)
+        if path.suffix == ".parquet":
+            return pd.read_parquet(path)
+        return pd.read_excel(path, dtype=str, keep_default_na=False)
+    
+    def canonical(self, chain):
+        """Key that is equal for chains producing identical output (fused tables)"""
+        key = []
+        for kind, op in self.engine.compile(chain):
+            if kind == "table":
+                op = tuple(sorted((k, v) for k, v in op.items() if k != v))
+                if not op:
+                    continue  # Substitutions that cancel out entirely
+            key.append((kind, op))
+        return tuple(key)
+    
+    def decode_group(self, values, chain):
+        """Undo chain on a list of values; returns (decoded, notes) per row"""
+        texts = list(values)
+        notes = [[] for _ in texts]
+        
+        for step, name in zip(range(len(chain), 0, -1), reversed(chain)):
+            cipher = CIPHERS[name]
             
-            print("✅" if verified else "⚠️")
+            # A solver seeing valid base64 here would be sent down the wrong path
+            if name != "base64":
+                for i, text in enumerate(texts):
+                    if text is not None and looks_like_base64(text):
+                        notes[i].append(f"input to step {step} ({name}) also decodes as base64")
             
-            # Rate limiting
-            if i % 10 == 0:
-                time.sleep(1)
+            if "table" in cipher:
+                live = [i for i, text in enumerate(texts) if text is not None]
+                decoded = translate_many([texts[i] for i in live], cipher["inverse"])
+                for i, text in zip(live, decoded):
+                    texts[i] = text
+            elif cipher["decode"] is None:
+                return [None] * len(texts), [[f"{name} has no decoder"] for _ in texts]
+            else:
+                for i, text in enumerate(texts):
+                    if text is None:
+                        continue
+                    try:
+                        texts[i] = cipher["decode"](text)
+                    except Exception:
+                        texts[i] = None
+                        notes[i].append(f"step {step} ({name}) failed to decode")
+        
+        return texts, notes
+    
+    def check(self, names, methods, values, flags):
+        """Check parallel lists of bank columns; returns report columns as a dict of lists"""
+        decoded_ok = [False] * len(methods)
+        problems = [""] * len(methods)
+        ambiguity = [[] for _ in methods]
         
-        # Save spreadsheet
-        df = pd.DataFrame(questions)
-        spreadsheet_path = self.output_dir / f"{self.student_id}_stegs.xlsx"
-        df.to_excel(spreadsheet_path, index=False)
+        groups = {}
+        for i, method in enumerate(methods):
+            groups.setdefault(method, []).append(i)
         
-        verified_count = len([q for q in questions if q['Verified'] == '✓'])
+        chains = {}
+        for method, rows in groups.items():
+            try:
+                chains[method] = parse_chain(method)
+            except ValueError as e:
+                for i in rows:
+                    problems[i] = str(e)
+                continue
+            
+            decoded, notes = self.decode_group([values[i] for i in rows], chains[method])
+            for i, text, note in zip(rows, decoded, notes):
+                decoded_ok[i] = text == flags[i] and values[i] != flags[i]
+                ambiguity[i].extend(note)
+                if text is None:
+                    problems[i] = "; ".join(note) or "could not decode"
+                elif values[i] == flags[i]:
+                    problems[i] = "Value is the flag itself (the chain cancels out)"
+                elif not decoded_ok[i]:
+                    problems[i] = f"decodes to {text!r}"
+        
+        # Different method names that produce identical ciphertext
+        by_key = {}
+        for method, chain in chains.items():
+            by_key.setdefault(self.canonical(chain), []).append(method)
+        for same in by_key.values():
+            for method in same:
+                others = [other for other in same if other != method]
+                if others:
+                    for i in groups[method]:
+                        ambiguity[i].append(f"indistinguishable from {', '.join(others)}")
         
-        print(f"\n{'='*70}")
-        print(f"✓ Generated {len(questions)}/{num_questions} questions")
-        print(f"✓ Verified: {verified_count}/{len(questions)}")
-        print(f"✓ Spreadsheet: {spreadsheet_path}")
-        print(f"✓ Stegged images: {self.stegged_dir}")
-        print(f"{'='*70}\n")
+        return {
+            'Challenge-Name': list(names),
+            'Method': list(methods),
+            'Decoded': ['✓' if ok else '✗' for ok in decoded_ok],
+            'Problem': problems,
+            'Ambiguity': ["; ".join(notes) for notes in ambiguity],
+        }
+    
+    def verify_rows(self, rows):
+        """Check a list of row dicts (no pandas needed); returns report columns"""
+        return self.check(
+            [row['Challenge-Name'] for row in rows],
+            [str(row['Method']) for row in rows],
+            [str(row['Value']) for row in rows],
+            [str(row['Flag']) for row in rows],
+        )
+    
+    def verify(self, source):
+        """Check a whole bank (DataFrame or file); returns one report row per question"""
+        import pandas as pd
         
-        return df
+        df = self.load(source)
+        names = df['Challenge-Name'] if 'Challenge-Name' in df else range(1, len(df) + 1)
+        return pd.DataFrame(self.check(
+            names,
+            df['Method'].astype(str).tolist(),
+            df['Value'].astype(str).tolist(),
+            df['Flag'].astype(str).tolist(),
+        ))
 
 
 class CompleteEncodingGenerator:
     """Generates encoding questions with multiple cipher types"""
     
-    def __init__(self, output_dir="encoding_output", student_id="student"):
+    def __init__(self, output_dir="encoding_output", student_id="student", tiers=None,
+                 sheet_format="xlsx", seed=None, week=None, flag_index=None):
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
         self.student_id = student_id
+        self.engine = CipherEngine()
+        self.tiers = tiers or DEFAULT_TIERS
+        self.sheet_format = sheet_format
+        
+        # Flags and chains come from per-question streams of this master seed
+        self.seed = new_seed() if seed is None else seed
+        self.week = week
+        
+        # Optional FlagIndex shared by every student and week, to keep flags unique
+        self.flag_index = flag_index
         
-    def generate_flag(self, theme_prefix="ENC", length=12):
-        """Generate a random flag"""
+    def generate_flag(self, theme_prefix="ENC", length=12, rng=None):
+        """Generate a random flag (from rng if given, else the global random module)"""
         chars = string.ascii_uppercase + string.ascii_lowercase + string.digits
-        random_part = ''.join(random.choices(chars, k=length))
+        random_part = ''.join((rng or random).choices(chars, k=length))
         return f"CAHSI-{theme_prefix}{random_part}"
     
+    def question_rng(self, index, attempt=0):
+        """Random stream for encoding question number index"""
+        return question_rng(self.seed, self.student_id, self.week, "encoding", index, attempt)
+    
+    def claim_flags(self, plan, theme_prefix):
+        """Register the plan's flags in the flag index, redrawing any already taken"""
+        if self.flag_index is None:
+            return plan
+        return claim_unique_flags(
+            self.flag_index, plan,
+            owner=lambda item: FlagIndex.owner(self.student_id, self.week, "encoding", item['index']),
+            redraw=lambda item, attempt: self.generate_flag(theme_prefix, 12,
+                                                            self.question_rng(item['index'], attempt)),
+        )
+    
     def caesar_cipher(self, text, shift):
         """Apply Caesar cipher"""
-        result = []
-        for char in text:
-            if char.isupper():
-                result.append(chr((ord(char) - 65 + shift) % 26 + 65))
-            elif char.islower():
-                result.append(chr((ord(char) - 97 + shift) % 26 + 97))
-            else:
-                result.append(char)
-        return ''.join(result)
+        return text.translate(caesar_table(shift))
     
     def rot13(self, text):
         """Apply ROT13"""
@@ -329,135 +2768,187 @@ class CompleteEncodingGenerator:
     
     def atbash(self, text):
         """Apply Atbash cipher"""
-        result = []
-        for char in text:
-            if char.isupper():
-                result.append(chr(90 - (ord(char) - 65)))
-            elif char.islower():
-                result.append(chr(122 - (ord(char) - 97)))
-            else:
-                result.append(char)
-        return ''.join(result)
+        return text.translate(ATBASH_TABLE)
     
     def reverse(self, text):
         """Reverse string"""
         return text[::-1]
     
-    def generate_single(self, flag):
+    def encode_batch(self, flags, method):
+        """Encode a list of flags with one method string (e.g. base64->caesar3->rot13)"""
+        return self.engine.encode_many(flags, method.split("->"))
+    
+    def generate_single(self, flag, rng=None):
         """Generate single encoding"""
-        encodings = [
-            ("base64", self.base64_encode),
-            ("caesar3", lambda x: self.caesar_cipher(x, 3)),
-            ("caesar7", lambda x: self.caesar_cipher(x, 7)),
-            ("caesar13", lambda x: self.caesar_cipher(x, 13)),
-            ("rot13", self.rot13),
-            ("atbash", self.atbash),
-            ("reverse", self.reverse),
-        ]
-        
-        method_name, encoder = random.choice(encodings)
-        return method_name, encoder(flag), 1
-    
-    def generate_double(self, flag):
+        method_name = (rng or random).choice(
+            ["base64", "caesar3", "caesar7", "caesar13", "rot13", "atbash", "reverse"]
+        )
+        return method_name, self.engine.encode(flag, [method_name]), 1
+    
+    def generate_double(self, flag, rng=None):
         """Generate double encoding"""
-        encoded = self.base64_encode(flag)
-        
-        second = [
-            ("caesar3", lambda x: self.caesar_cipher(x, 3)),
-            ("caesar7", lambda x: self.caesar_cipher(x, 7)),
-            ("rot13", self.rot13),
-        ]
-        
-        method2, encoder2 = random.choice(second)
-        final = encoder2(encoded)
+        method2 = (rng or random).choice(["caesar3", "caesar7", "rot13"])
+        final = self.engine.encode(flag, ["base64", method2])
         
         return f"base64->{method2}", final, 1
     
-    def generate_triple(self, flag):
+    def generate_triple(self, flag, rng=None):
         """Generate triple encoding"""
-        encoded1 = self.base64_encode(flag)
-        shift = random.choice([3, 7, 13])
-        encoded2 = self.caesar_cipher(encoded1, shift)
-        encoded3 = self.rot13(encoded2)
+        shift = (rng or random).choice([3, 7, 13])
+        # caesar + rot13 compile into a single fused table pass
+        encoded3 = self.engine.encode(flag, ["base64", f"caesar{shift}", "rot13"])
         
         return f"base64->caesar{shift}->rot13", encoded3, 2
     
-    def generate_questions(self, num_questions=25, theme="Cipher"):
-        """Generate all encoding questions"""
-        questions = []
-        
-        print(f"\n{'='*70}")
-        print(f"GENERATING {num_questions} ENCODING QUESTIONS")
-        print(f"{'='*70}\n")
+    def tier_counts(self, num_questions):
+        """Split num_questions across the tiers by weight (last tier takes the remainder)"""
+        total_weight = sum(tier["weight"] for tier in self.tiers)
+        counts = [int(num_questions * tier["weight"] / total_weight) for tier in self.tiers[:-1]]
+        counts.append(num_questions - sum(counts))
+        return counts
+    
+    def pick_chain(self, tier, rng=None):
+        """Choose a chain (tuple of cipher names) for one question of a tier"""
+        rng = rng or random
+        if "chains" in tier:
+            return parse_chain(rng.choice(tier["chains"]))
         
-        num_single = int(num_questions * 0.6)
-        num_double = int(num_questions * 0.3)
-        num_triple = num_questions - num_single - num_double
+        # Random chain of the requested depth, never repeating a step back to back, and
+        # redrawn when substitutions cancel out (the Value would give away the flag)
+        for _ in range(100):
+            chain = []
+            for _ in range(tier["depth"]):
+                choices = [name for name in tier["pool"] if not chain or name != chain[-1]]
+                chain.append(rng.choice(choices))
+            if not chain_cancels(chain):
+                return parse_chain("|".join(chain))
+        raise ValueError(f"Tier {tier['name']}: every chain drawn from its pool cancels out")
+    
+    def plan_item(self, tier, index, theme_prefix):
+        """Tier, chain and flag for question number index, from its own random stream"""
+        rng = self.question_rng(index)
+        chain = self.pick_chain(tier, rng)
+        return {
+            'index': index,
+            'tier': tier["name"],
+            'chain': chain,
+            'points': tier["points"],
+            'flag': self.generate_flag(theme_prefix, 12, rng),
+        }
+    
+    def iter_plan(self, num_questions, theme_prefix="ENC"):
+        """Yield every question's tier, chain and flag, in question order"""
+        index = 0
+        for tier, count in zip(self.tiers, self.tier_counts(num_questions)):
+            for _ in range(count):
+                index += 1
+                yield self.plan_item(tier, index, theme_prefix)
+    
+    def plan_questions(self, num_questions, theme_prefix="ENC"):
+        """Decide every question's tier, chain and flag up front"""
+        return list(self.iter_plan(num_questions, theme_prefix))
+    
+    def question_at(self, index, num_questions, theme="Cipher"):
+        """Regenerate one question of a bank from its coordinates, without the rest"""
+        if not 1 <= index <= num_questions:
+            raise ValueError(f"Question {index} is outside a bank of {num_questions}")
+        first = 1
+        for tier, count in zip(self.tiers, self.tier_counts(num_questions)):
+            if index < first + count:
+                item = self.plan_item(tier, index, theme[:3].upper())
+                self.claim_flags([item], theme[:3].upper())  # Picks up a redrawn flag
+                return self.encode_chunk([item], theme, index)[0]
+            first += count
+    
+    def encode_chunk(self, plan, theme, first_num):
+        """Encoded values for a slice of the plan, as spreadsheet rows"""
+        flags = [item['flag'] for item in plan]
         
-        question_num = 1
+        # Encode chain by chain: each distinct chain is compiled once and run
+        # over all of its flags in a single batch
+        by_chain = {}
+        for i, item in enumerate(plan):
+            by_chain.setdefault(item['chain'], []).append(i)
+        values = [None] * len(plan)
+        for chain, indexes in by_chain.items():
+            encoded = self.engine.encode_many([flags[i] for i in indexes], chain)
+            for i, value in zip(indexes, encoded):
+                values[i] = value
         
-        # Single encodings
-        for i in range(num_single):
-            flag = self.generate_flag(theme[:3].upper(), 12)
-            method, encoded, points = self.generate_single(flag)
-            
+        questions = []
+        for question_num, (item, flag, value) in enumerate(zip(plan, flags, values), first_num):
+            method = format_chain(item['chain'])
             questions.append({
                 'Challenge-Name': f"{theme}{question_num:03d}",
                 'Flag': flag,
                 'Method': method,
                 'Cipher': method,
-                'Value': encoded,
-                'Points': points
+                'Value': value,
+                'Points': item['points']
             })
-            question_num += 1
-        
-        print(f"✓ Generated {num_single} single encodings")
+        return questions
+    
+    def generate_questions(self, num_questions=25, theme="Cipher", collect=True, chunk_size=10000):
+        """Generate all encoding questions
         
-        # Double encodings
-        for i in range(num_double):
-            flag = self.generate_flag(theme[:3].upper(), 12)
-            method, encoded, points = self.generate_double(flag)
-            
-            questions.append({
-                'Challenge-Name': f"{theme}{question_num:03d}",
-                'Flag': flag,
-                'Method': method,
-                'Cipher': method,
-                'Value': encoded,
-                'Points': points
-            })
-            question_num += 1
+        Rows are produced and written in chunks of chunk_size, so memory stays
+        flat for very large banks when collect=False (returns the row count
+        instead of a DataFrame).
+        """
+        print(f"\n{'='*70}")
+        print(f"GENERATING {num_questions} ENCODING QUESTIONS")
+        print(f"{'='*70}\n")
         
-        print(f"✓ Generated {num_double} double encodings")
+        spreadsheet_path = self.output_dir / f"{self.student_id}_encodings.{self.sheet_format}"
+        verifier = EncodingVerifier(self.engine)
+        plan = self.iter_plan(num_questions, theme[:3].upper())
+        questions = []
+        written = decoded_count = ambiguous_count = 0
         
-        # Triple encodings
-        for i in range(num_triple):
-            flag = self.generate_flag(theme[:3].upper(), 12)
-            method, encoded, points = self.generate_triple(flag)
-            
-            questions.append({
-                'Challenge-Name': f"{theme}{question_num:03d}",
-                'Flag': flag,
-                'Method': method,
-                'Cipher': method,
-                'Value': encoded,
-                'Points': points
-            })
-            question_num += 1
+        progress = Progress(num_questions)
         
-        print(f"✓ Generated {num_triple} triple encodings")
+        with open_row_sink(spreadsheet_path, ENCODING_COLUMNS) as sink:
+            while True:
+                chunk = list(itertools.islice(plan, chunk_size))
+                if not chunk:
+                    break
+                with instrumentation.span("claim_flags", rows=len(chunk)):
+                    self.claim_flags(chunk, theme[:3].upper())
+                with instrumentation.span("encode", rows=len(chunk)):
+                    rows = self.encode_chunk(chunk, theme, written + 1)
+                
+                # Decode everything back as a sanity check
+                with instrumentation.span("decode_check", rows=len(rows)):
+                    report = verifier.verify_rows(rows)
+                decoded_count += report['Decoded'].count('✓')
+                ambiguous_count += sum(1 for note in report['Ambiguity'] if note)
+                
+                with instrumentation.span("sheet_write", rows=len(rows)):
+                    for row in rows:
+                        sink.write(row)
+                written += len(rows)
+                if collect:
+                    questions.extend(rows)
+                if num_questions > chunk_size:
+                    print(f"Encoded {written}/{num_questions} ({progress.tick(len(rows))})")
         
-        # Save spreadsheet
-        df = pd.DataFrame(questions)
-        spreadsheet_path = self.output_dir / f"{self.student_id}_encodings.xlsx"
-        df.to_excel(spreadsheet_path, index=False)
+        for tier, count in zip(self.tiers, self.tier_counts(num_questions)):
+            print(f"✓ Generated {count} {tier['name']} encodings")
+        print(f"✓ Decoded back to flag: {decoded_count}/{written}")
+        if ambiguous_count:
+            print(f"⚠️  Ambiguous (see EncodingVerifier report): {ambiguous_count}")
         
         print(f"\n{'='*70}")
-        print(f"✓ Total: {len(questions)} encoding questions")
+        print(f"✓ Total: {written} encoding questions")
         print(f"✓ Spreadsheet: {spreadsheet_path}")
         print(f"{'='*70}\n")
         
-        return df
+        if not collect:
+            return written
+        
+        import pandas as pd
+        
+        return pd.DataFrame(questions, columns=ENCODING_COLUMNS)
 
 
 def main():
@@ -520,16 +3011,74 @@ def main():
     theme_input = input("Theme (default 'Cats'): ").strip()
     theme = theme_input if theme_input else 'Cats'
     
+    week_dir = generate_week(student_id, week, steg, encoding, theme)
+    if week_dir is None:
+        input("\nPress Enter to exit...")
+        return 1
+    
+    print("NEXT STEPS:")
+    print(f"1. Find your files in: {week_dir.absolute()}")
+    print(f"2. Test with Futureboy: https://futureboy.us/stegano/decinput.html")
+    print(f"3. Upload stegged images from: {week_dir / 'steganography' / 'stegged_images'}")
+    print(f"4. Upload spreadsheets to your Google Drive folder")
+    print(f"5. Submit your bi-weekly report on Canvas\n")
+    
+    input("Press Enter to exit...")
+    return 0
+
+
+def encoding_bank_record(sheet):
+    """Path of the record written once an encoding sheet is complete"""
+    sheet = Path(sheet)
+    return sheet.with_name(f"{sheet.name}.done.json")
+
+
+def encoding_bank_done(sheet, count, theme, seed=None):
+    """Whether sheet holds a finished bank of `count` questions for theme (and seed, if given)"""
+    record = encoding_bank_record(sheet)
+    if not Path(sheet).exists() or not record.exists():
+        return False
+    try:
+        done = json.loads(record.read_text())
+    except (OSError, ValueError):
+        return False
+    if done.get('questions') != count or done.get('theme') != theme:
+        return False
+    return seed is None or done.get('seed') == seed
+
+
+def generate_week(student_id, week, steg=25, encoding=25, theme="Cats", output_root=".",
+                  image_source="cataas", backend="subprocess", cover_cache="cover_cache",
+                  sheet_format="xlsx", fetch_workers=4, embed_workers=None, verify_workers=None,
+                  fresh=False, plan_covers=True, seed=None, flag_index="flag_index.sqlite",
+                  time_budget=None, keep_originals=True, bundle=None, reuse_covers=False, covers=None):
+    """Generate one week of questions for one student; returns the week directory (None on error)
+    
+    Pass steg=0 or encoding=0 to skip a kind. Only the stages that run
+    import their heavy dependencies. Reruns resume where the last run
+    stopped unless fresh=True. Passing the same seed reproduces the same
+    flags and cipher chains. Every flag is registered in flag_index (a path
+    or FlagIndex; None to skip), which redraws flags already used anywhere.
+    With bundle set to a format from BUNDLE_FORMATS, the stegged images and
+    spreadsheets are streamed into <student>_week<N>.<ext> in the week
+    directory as they are finished. covers are cache paths set aside for
+    this week (batch mode); the ones left unused go back to the cache.
+    """
     # Create week directory
-    week_dir = Path(f"week_{week}")
-    week_dir.mkdir(exist_ok=True)
+    week_dir = Path(output_root) / f"week_{week}"
+    week_dir.mkdir(parents=True, exist_ok=True)
     
     start_time = time.time()
+    requested_seed = seed
+    seed = new_seed() if seed is None else seed
+    if isinstance(flag_index, (str, Path)):
+        flag_index = FlagIndex(flag_index)
     
     print(f"\n{'#'*70}")
     print(f"#  WEEK {week} - STARTING GENERATION")
     print(f"#  Student: {student_id}")
     print(f"#  Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"#  Seed: {seed}")
     print(f"{'#'*70}\n")
     
     total = steg + encoding
@@ -537,49 +3086,931 @@ def main():
     print(f"   • {steg} steganography questions")
     print(f"   • {encoding} encoding questions\n")
     
+    generated = 0
+    
+    upload = UploadBundle(week_dir / f"{student_id}_week{week}{BUNDLE_FORMATS[bundle]}") if bundle else None
+    
     # Generate encoding questions
-    try:
-        encoding_gen = CompleteEncodingGenerator(
-            output_dir=str(week_dir / "encodings"),
-            student_id=student_id
-        )
-        encoding_df = encoding_gen.generate_questions(encoding, f"{theme}Code")
-    except Exception as e:
-        print(f"\nERROR generating encoding questions: {e}")
-        input("\nPress Enter to exit...")
-        return 1
+    encoding_sheet = week_dir / "encodings" / f"{student_id}_encodings.{sheet_format}"
+    if encoding and not fresh and encoding_bank_done(encoding_sheet, encoding, theme, requested_seed):
+        print(f"✓ Encoding questions already generated: {encoding_sheet} (use --fresh to redo)")
+    elif encoding:
+        try:
+            encoding_gen = CompleteEncodingGenerator(
+                output_dir=str(week_dir / "encodings"),
+                student_id=student_id,
+                sheet_format=sheet_format,
+                seed=seed,
+                week=week,
+                flag_index=flag_index
+            )
+            encoding_bank_record(encoding_sheet).unlink(missing_ok=True)
+            generated += encoding_gen.generate_questions(encoding, f"{theme}Code", collect=False)
+            encoding_bank_record(encoding_sheet).write_text(json.dumps(
+                {'questions': encoding, 'theme': theme, 'seed': seed, 'time': time.time()}))
+        except Exception as e:
+            print(f"\nERROR generating encoding questions: {e}")
+            if upload:
+                upload.abort()
+            return None
+    if upload and encoding:
+        upload.add(encoding_sheet, f"encodings/{encoding_sheet.name}")
     
     # Generate steganography questions
-    try:
-        steg_gen = SteghideGenerator(
-            output_dir=str(week_dir / "steganography"),
-            student_id=student_id
-        )
-        steg_df = steg_gen.generate_questions(steg, theme)
-    except Exception as e:
-        print(f"\nERROR generating steganography questions: {e}")
-        print(f"\nMake sure the 'steghide' folder is in the same directory as this script!")
-        input("\nPress Enter to exit...")
-        return 1
+    if steg:
+        steg_gen = None
+        try:
+            if isinstance(cover_cache, (str, Path)):
+                cover_cache = CoverCache(cover_cache, reuse=reuse_covers)
+            if isinstance(image_source, str):
+                image_source = make_image_source(image_source, theme=theme, pool_size=fetch_workers,
+                                                 stream=f"{student_id}/week_{week}", seed=seed)
+            steg_gen = SteghideGenerator(
+                output_dir=str(week_dir / "steganography"),
+                student_id=student_id,
+                fetch_workers=fetch_workers,
+                embed_workers=embed_workers,
+                verify_workers=verify_workers,
+                image_source=image_source,
+                # Indexed sources make each question's cover themselves, nothing comes from the cache
+                cover_cache=None if image_source.indexed else cover_cache,
+                backend=backend,
+                sheet_format=sheet_format,
+                plan_covers=plan_covers,
+                seed=seed,
+                week=week,
+                flag_index=flag_index,
+                keep_originals=keep_originals,
+                bundle=upload,
+                covers=covers
+            )
+            steg_df = steg_gen.generate_questions(steg, theme, pipelined=True, resume=not fresh,
+                                                  time_budget=time_budget)
+            generated += len(steg_df)
+        except Exception as e:
+            print(f"\nERROR generating steganography questions: {e}")
+            print(f"\nMake sure the 'steghide' folder is in the same directory as this script!")
+            if upload:
+                upload.abort()
+            return None
+        finally:
+            # Covers set aside for this week that it didn't use go back to the cache
+            if isinstance(cover_cache, CoverCache):
+                for path in (steg_gen.reserved if steg_gen else covers or ()):
+                    cover_cache.release(path)
+        if upload:
+            steg_sheet = steg_gen.output_dir / f"{student_id}_stegs.{sheet_format}"
+            upload.add(steg_sheet, f"steganography/{steg_sheet.name}")
+    
+    if upload:
+        print(f"✓ Upload bundle: {upload.close()}")
     
     elapsed = time.time() - start_time
     
     print(f"\n{'#'*70}")
     print(f"#  COMPLETE!")
-    print(f"#  Generated {len(encoding_df) + len(steg_df)} questions in {elapsed:.1f} seconds")
+    print(f"#  Generated {generated} questions in {elapsed:.1f} seconds")
     print(f"#  Output directory: {week_dir.absolute()}")
     print(f"{'#'*70}\n")
     
-    print("NEXT STEPS:")
-    print(f"1. Find your files in: {week_dir.absolute()}")
-    print(f"2. Test with Futureboy: https://futureboy.us/stegano/decinput.html")
-    print(f"3. Upload stegged images from: {week_dir / 'steganography' / 'stegged_images'}")
-    print(f"4. Upload spreadsheets to your Google Drive folder")
-    print(f"5. Submit your bi-weekly report on Canvas\n")
+    return week_dir
+
+
+def parse_weeks(spec):
+    """Week list from a spec like 1-8 or 1,3,5-6"""
+    weeks = set()
+    for part in str(spec).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            weeks.update(range(int(first), int(last) + 1))
+        else:
+            weeks.add(int(part))
+    if not weeks or not all(1 <= week <= 8 for week in weeks):
+        raise ValueError(f"Weeks must be between 1 and 8: {spec}")
+    return sorted(weeks)
+
+
+def read_roster(path):
+    """Student IDs from a roster file: one per line, blank lines and #comments ignored"""
+    students = []
+    for line in Path(path).read_text().splitlines():
+        line = line.split("#", 1)[0].strip()
+        if line and line not in students:
+            students.append(line)
+    return students
+
+
+def run_batch_job(job):
+    """Process-pool worker: generate one (student, week), logging to the week folder"""
+    student_id, week, options = job
+    output_root = Path(options.pop("output_root")) / student_id
+    log_path = output_root / f"week_{week}" / "generate.log"
+    log_path.parent.mkdir(parents=True, exist_ok=True)
     
-    input("Press Enter to exit...")
+    trace = options.pop("trace", None)
+    if trace and not Path(trace).is_absolute():
+        trace = log_path.parent / trace
+    
+    start = time.time()
+    with open(log_path, "w", encoding="utf-8") as log, contextlib.redirect_stdout(log):
+        with instrumentation.trace(trace) if trace else contextlib.nullcontext():
+            week_dir = generate_week(student_id, week, output_root=output_root, **options)
+    return student_id, week, week_dir is not None, time.time() - start, log_path
+
+
+def finished_steg_questions(output_root, student_id, week):
+    """Verified steganography questions an earlier batch run left for (student, week)"""
+    manifest = Manifest(Path(output_root) / student_id / f"week_{week}" / "steganography" / "manifest.jsonl")
+    return sum(1 for record in manifest.latest().values() if record.get('verified'))
+
+
+def release_unused_covers(cache, covers, output_root, student_id, week):
+    """Give back the reserved covers a failed (student, week) job left unused"""
+    manifest = Manifest(Path(output_root) / student_id / f"week_{week}" / "steganography" / "manifest.jsonl")
+    used = {record.get('cover_cached') for record in manifest.latest().values()}
+    for path in covers or ():
+        if Path(path).name not in used:
+            cache.release(path)
+
+
+def run_batch(students, weeks, output_root="cohort", processes=None, prefetch=None, trace=None,
+              **options):
+    """Generate every (student, week) across a process pool; returns the number of failed jobs
+    
+    All jobs share one cover cache directory and the same steghide backend
+    choice, and write to output_root/<student>/week_N/. Before the pool
+    starts, the cache is topped up with `prefetch` covers (default: enough
+    for every job) and each job is handed its own covers, so the workers
+    don't hit the image API and no two student-weeks share a cover. With
+    trace set, each job records a trace (relative paths land in its week
+    folder).
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    
+    jobs = [(student, week) for student in students for week in weeks]
+    cores = os.cpu_count() or 2
+    processes = processes or min(cores, len(jobs)) or 1
+    
+    # Split the cores between processes so the inner pipelines don't oversubscribe
+    options.setdefault("embed_workers", max(1, cores // processes))
+    options.setdefault("verify_workers", max(1, cores // processes))
+    
+    print(f"\n{'#'*70}")
+    print(f"#  BATCH: {len(students)} students x {len(weeks)} weeks = {len(jobs)} jobs")
+    print(f"#  Processes: {processes}")
+    print(f"#  Output: {Path(output_root).absolute()}")
+    print(f"{'#'*70}\n")
+    
+    # Locate steghide once, before any covers are reserved for jobs that couldn't run
+    steg = options.get("steg", 25)
+    if steg and isinstance(options.get("backend", "subprocess"), str):
+        try:
+            options["backend"] = make_steghide_backend(options.get("backend", "subprocess"))
+        except (OSError, ValueError) as e:
+            print(f"ERROR: {e}")
+            return len(jobs)
+    
+    # One shared supply of covers for the whole cohort, split between the jobs up front
+    cover_cache = options.get("cover_cache", "cover_cache")
+    image_source = options.get("image_source", "cataas")
+    cache = None
+    reserved = {}
+    if steg and cover_cache and isinstance(image_source, str) and not is_procedural_spec(image_source):
+        cache = CoverCache(cover_cache, reuse=options.get("reuse_covers", False),
+                           image_source=make_image_source(image_source, theme=options.get("theme"),
+                                                          stream="prefetch"))
+        needed = {job: steg if options.get("fresh") else max(0, steg - finished_steg_questions(output_root, *job))
+                  for job in jobs}
+        spare = len(cache.available())
+        missing = (sum(needed.values()) if prefetch is None else prefetch) - spare
+        if missing > 0:
+            print(f"Prefetching {missing} covers into {cache.root}...")
+        
+        # Download and reserve job by job: reserved covers are held, so later
+        # downloads can't evict them, and nothing is fetched past the budget
+        for job in jobs:
+            short = min(needed[job] - spare, missing)
+            if short > 0 and cache.size() >= cache.max_bytes:
+                print(f"⚠️  Cover cache is at its {cache.max_bytes // 2**20} MB budget; "
+                      f"the remaining jobs fetch their own covers")
+                missing = 0
+            elif short > 0:
+                spare += cache.prefetch(short)
+                missing -= short
+            covers = (cache.take() for _ in range(needed[job]))
+            reserved[job] = [str(path) for path in itertools.takewhile(bool, covers)]
+            spare = max(0, spare - len(reserved[job]))
+    
+    start = time.time()
+    failed = 0
+    progress = Progress(len(jobs))
+    
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = {
+            pool.submit(run_batch_job, (student, week, dict(options, output_root=output_root, trace=trace,
+                                                            covers=reserved.get((student, week))))): (student, week)
+            for student, week in jobs
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            job = futures[future]
+            try:
+                student_id, week, ok, elapsed, log_path = future.result()
+                status = "✅" if ok else f"✗ (see {log_path})"
+                print(f"[{done}/{len(jobs)}] {student_id} week {week} {status} ({elapsed:.1f}s; {progress.tick()})")
+            except Exception as e:
+                ok = False
+                print(f"[{done}/{len(jobs)}] ✗ job crashed: {e} ({progress.tick()})")
+            if not ok:
+                failed += 1
+                if cache:
+                    # Covers the job never got to use go back to the cache for the other jobs
+                    release_unused_covers(cache, reserved.get(job), output_root, *job)
+    
+    elapsed = time.time() - start
+    print(f"\n{'#'*70}")
+    print(f"#  BATCH COMPLETE: {len(jobs) - failed}/{len(jobs)} jobs in {elapsed:.1f} seconds")
+    print(f"{'#'*70}\n")
+    
+    return failed
+
+
+class PoolExhausted(Exception):
+    """The warm pool could not supply a bundle in time"""
+
+
+class ChallengePool:
+    """Warm reservoir of pre-generated questions, refilled in the background
+    
+    Two refill threads watch the reservoir. When the stegged images or any
+    encoding tier drop below low_water (a fraction of capacity), they run
+    SteghideGenerator / CompleteEncodingGenerator batches until it is full
+    again, so generation never runs further ahead than capacity. Each batch
+    generates as its own "pool-<batch>" student, keeping flags unique in
+    the flag index; serving a question reassigns its flag to the student.
+    
+    Stegged images wait on disk under root/steg/<batch>/ and are found
+    again through each batch's manifest after a restart. Encoding
+    questions are cheap to make and are only kept in memory.
+    """
+    
+    def __init__(self, root="challenge_pool", steg=25, encoding=25, steg_capacity=100,
+                 encoding_capacity=250, low_water=0.5, theme="Cats", sheet_format="xlsx",
+                 flag_index=None, tiers=None, batch_size=25, steg_options=None):
+        self.root = Path(root)
+        (self.root / "steg").mkdir(parents=True, exist_ok=True)
+        (self.root / "encodings").mkdir(parents=True, exist_ok=True)
+        self.steg = steg
+        self.encoding = encoding
+        self.steg_capacity = steg_capacity
+        self.encoding_capacity = encoding_capacity
+        self.low_water = low_water
+        self.theme = theme
+        self.sheet_format = sheet_format
+        self.flag_index = flag_index
+        self.tiers = tiers or DEFAULT_TIERS
+        self.batch_size = batch_size
+        
+        # SteghideGenerator keyword arguments (image_source, cover_cache, backend, workers...)
+        self.steg_options = dict(steg_options or {})
+        
+        # Reservoir: stegged images on disk, encoding rows per tier
+        self.stegs = collections.deque()
+        self.encodings = {tier['name']: collections.deque() for tier in self.tiers}
+        self.planner = CompleteEncodingGenerator(output_dir=self.root / "encodings", tiers=self.tiers)
+        self.bundle_counts = self.planner.tier_counts(encoding) if encoding else []
+        
+        # Refills start below the low-water mark, so a bundle must fit in what is left there
+        if steg > low_water * steg_capacity or any(
+                count > low_water * target
+                for count, target in zip(self.bundle_counts, self.planner.tier_counts(encoding_capacity))):
+            raise ValueError(f"A bundle ({steg} steg, {encoding} encoding) needs more questions than the pool "
+                             f"keeps at its low-water mark ({low_water:g} x {steg_capacity} steg, "
+                             f"{encoding_capacity} encoding)")
+        
+        # Set once a level drops below low water, cleared when it is full again
+        self._filling = {'steg': False, 'encoding': False}
+        
+        self._ready = threading.Condition()
+        self._stop = threading.Event()
+        self._batches = itertools.count(1)
+        self._serving = collections.defaultdict(threading.Lock)
+        self._threads = []
+        
+        for batch_dir in sorted((self.root / "steg").iterdir()):
+            self.load_steg_batch(batch_dir)
+    
+    def new_batch(self):
+        """Name for the next refill batch (also its student ID in the flag index)"""
+        return f"pool-{datetime.now():%Y%m%d%H%M%S}-{os.getpid()}-{next(self._batches)}"
+    
+    def load_steg_batch(self, batch_dir):
+        """Add a batch's verified, still unserved stegged images to the reservoir"""
+        manifest = Manifest(batch_dir / "manifest.jsonl")
+        items = []
+        for index, record in sorted(manifest.latest().items()):
+            path = batch_dir / "stegged_images" / record['file']
+            if record.get('verified') and path.exists():
+                items.append({'flag': record['flag'], 'path': path})
+        with self._ready:
+            self.stegs.extend(items)
+            self._ready.notify_all()
+        return len(items)
+    
+    def steg_missing(self):
+        """Stegged images to make now: from below the low-water mark until the pool is full, else 0"""
+        with self._ready:
+            level = len(self.stegs)
+            if level < self.low_water * self.steg_capacity:
+                self._filling['steg'] = True
+            elif level >= self.steg_capacity:
+                self._filling['steg'] = False
+            return self.steg_capacity - level if self._filling['steg'] else 0
+    
+    def encoding_missing(self):
+        """Encoding questions to make now: from when any tier is below low water until full, else 0"""
+        with self._ready:
+            targets = self.planner.tier_counts(self.encoding_capacity)
+            levels = [len(self.encodings[tier['name']]) for tier in self.tiers]
+            if any(level < self.low_water * target for level, target in zip(levels, targets)):
+                self._filling['encoding'] = True
+            elif sum(levels) >= self.encoding_capacity:
+                self._filling['encoding'] = False
+            return max(0, self.encoding_capacity - sum(levels)) if self._filling['encoding'] else 0
+    
+    def refill_steg(self, count):
+        """Generate one batch of stegged images into the reservoir"""
+        batch = self.new_batch()
+        batch_dir = self.root / "steg" / batch
+        batch_dir.mkdir()
+        options = dict(self.steg_options)
+        if options.get('image_source') and options['image_source'].indexed:
+            # Covers come from the question index, so each batch needs its own stream
+            options['image_source'] = options['image_source'].with_stream(f"pool/{batch}")
+        gen = SteghideGenerator(output_dir=batch_dir, student_id=batch, keep_originals=False,
+                                flag_index=self.flag_index, sheet_format="csv", **options)
+        self.steg_options['backend'] = gen.backend  # Locate steghide once, not per batch
+        gen.generate_questions(min(count, self.batch_size), self.theme, pipelined=True, resume=False)
+        if gen.cover_cache:
+            # Pool batches never look at their covers again, so the cache may evict them
+            for record in Manifest(batch_dir / "manifest.jsonl").latest().values():
+                if record.get('cover_cached'):
+                    gen.cover_cache.unhold(record['cover_cached'])
+        return self.load_steg_batch(batch_dir)
+    
+    def refill_encodings(self, count):
+        """Generate one batch of encoding questions into the reservoir"""
+        batch = self.new_batch()
+        gen = CompleteEncodingGenerator(output_dir=self.root / "encodings", student_id=batch,
+                                        tiers=self.tiers, flag_index=self.flag_index)
+        theme_prefix = f"{self.theme}Code"[:3].upper()
+        plan = gen.claim_flags(gen.plan_questions(count, theme_prefix), theme_prefix)
+        rows = gen.encode_chunk(plan, f"{self.theme}Code", 1)
+        with self._ready:
+            for item, row in zip(plan, rows):
+                self.encodings[item['tier']].append(row)
+            self._ready.notify_all()
+        return len(rows)
+    
+    def _refill_loop(self, missing, refill):
+        """Refill thread: sleep above the low-water mark, generate below it"""
+        failures = 0
+        while not self._stop.is_set():
+            count = missing()
+            if not count:
+                with self._ready:
+                    self._ready.wait(timeout=1)  # take() wakes us early
+                continue
+            try:
+                refill(count)
+                failures = 0
+            except Exception as e:
+                print(f"\n✗ Pool refill failed: {e}")
+                self._stop.wait(backoff_delay(failures, base=1.0, cap=60.0))
+                failures += 1
+    
+    def start(self):
+        """Start the refill threads"""
+        for name, missing, refill in [("steg", self.steg_missing, self.refill_steg),
+                                      ("encoding", self.encoding_missing, self.refill_encodings)]:
+            if (name == "steg" and not self.steg) or (name == "encoding" and not self.encoding):
+                continue
+            thread = threading.Thread(target=self._refill_loop, args=(missing, refill),
+                                      name=f"refill-{name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+    
+    def stop(self):
+        """Stop refilling (the batch in progress finishes first)"""
+        self._stop.set()
+        with self._ready:
+            self._ready.notify_all()
+        for thread in self._threads:
+            thread.join()
+    
+    def status(self):
+        """Reservoir levels, for /status"""
+        with self._ready:
+            return {
+                'steg': len(self.stegs),
+                'steg_capacity': self.steg_capacity,
+                'encodings': {name: len(rows) for name, rows in self.encodings.items()},
+                'encoding_capacity': self.encoding_capacity,
+            }
+    
+    def take(self, timeout=30):
+        """Remove one bundle's worth of questions; waits up to timeout for refills
+        
+        Questions are taken all at once or not at all, so waiting requests
+        never hold a partial share of the reservoir. Raises PoolExhausted.
+        """
+        def enough():
+            return len(self.stegs) >= self.steg and all(
+                len(self.encodings[tier['name']]) >= count for tier, count in zip(self.tiers, self.bundle_counts))
+        
+        with self._ready:
+            self._ready.notify_all()  # Let the refill threads check the levels
+            if not self._ready.wait_for(enough, timeout=timeout):
+                raise PoolExhausted(f"pool is empty, still refilling ({len(self.stegs)} stegged images ready)")
+            stegs = [self.stegs.popleft() for _ in range(self.steg)]
+            rows = []
+            for tier, count in zip(self.tiers, self.bundle_counts):
+                rows.extend(self.encodings[tier['name']].popleft() for _ in range(count))
+            self._ready.notify_all()
+        return stegs, rows
+    
+    def bundle_path(self, student_id, week):
+        """Where the bundle served to a student for a week is kept"""
+        return self.root / "served" / student_id / f"week_{week}" / f"{student_id}_week{week}.zip"
+    
+    def serve(self, student_id, week, timeout=30):
+        """Path of the student's zip for the week, building it from the pool the first time
+        
+        A week is only ever served once; asking again returns the same bundle.
+        """
+        path = self.bundle_path(student_id, week)
+        with self._serving[(student_id, week)]:
+            if path.exists():
+                return path
+            
+            stegs, rows = self.take(timeout)
+            upload = UploadBundle(path)
+            try:
+                self.write_week(student_id, week, stegs, rows, upload)
+            except BaseException:
+                upload.abort()
+                raise
+            return upload.close()
+    
+    def write_week(self, student_id, week, stegs, rows, upload):
+        """Lay the taken questions out as a normal week folder and queue them for the bundle"""
+        week_dir = self.bundle_path(student_id, week).parent
+        steg_dir = week_dir / "steganography"
+        (steg_dir / "stegged_images").mkdir(parents=True, exist_ok=True)
+        (week_dir / "encodings").mkdir(exist_ok=True)
+        moves = []
+        
+        if stegs:
+            steg_sheet = steg_dir / f"{student_id}_stegs.{self.sheet_format}"
+            with open_row_sink(steg_sheet, STEG_COLUMNS) as sink:
+                for i, item in enumerate(stegs, 1):
+                    steg_path = steg_dir / "stegged_images" / f"{self.theme.lower()}_{i:03d}_steg.jpg"
+                    shutil.move(item['path'], steg_path)
+                    batch_dir = item['path'].parent.parent
+                    if not any(batch_dir.glob("stegged_images/*.jpg")):
+                        shutil.rmtree(batch_dir, ignore_errors=True)  # Batch fully served
+                    sink.write({
+                        'Challenge-Name': f"{self.theme}Steg{i:03d}",
+                        'File-Name': steg_path.name,
+                        'Flag': item['flag'],
+                        'Method': 'steghide',
+                        'Value': 1,
+                        'Verified': '✓'
+                    })
+                    upload.add(steg_path, f"steganography/stegged_images/{steg_path.name}")
+                    moves.append((item['flag'], FlagIndex.owner(student_id, week, "steg", i)))
+            upload.add(steg_sheet, f"steganography/{steg_sheet.name}")
+        
+        if rows:
+            encoding_sheet = week_dir / "encodings" / f"{student_id}_encodings.{self.sheet_format}"
+            with open_row_sink(encoding_sheet, ENCODING_COLUMNS) as sink:
+                for i, row in enumerate(rows, 1):
+                    sink.write(dict(row, **{'Challenge-Name': f"{self.theme}Code{i:03d}"}))
+                    moves.append((row['Flag'], FlagIndex.owner(student_id, week, "encoding", i)))
+            upload.add(encoding_sheet, f"encodings/{encoding_sheet.name}")
+        
+        if self.flag_index is not None:
+            self.flag_index.reassign(moves)
+
+
+def make_pool_server(pool, host="127.0.0.1", port=8399, max_requests=4, wait=30):
+    """HTTP front end for a ChallengePool
+    
+    GET /bundle?student=ID&week=N returns the student's zip for the week,
+    GET /status the reservoir levels as JSON. At most max_requests bundles
+    are built at once; beyond that, and when the pool stays empty for
+    `wait` seconds, the server answers 503 with a Retry-After header
+    instead of queueing without bound.
+    """
+    import http.server
+    from urllib.parse import parse_qs, urlparse
+    
+    slots = threading.BoundedSemaphore(max_requests)
+    
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        
+        def reply(self, status, body, content_type="application/json", headers=()):
+            if isinstance(body, (dict, list)):
+                body = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/status":
+                return self.reply(200, pool.status())
+            if url.path != "/bundle":
+                return self.reply(404, {'error': "unknown path (use /bundle or /status)"})
+            
+            query = parse_qs(url.query)
+            student_id = query.get("student", [""])[0]
+            week = query.get("week", [""])[0]
+            if not re.fullmatch(r"[A-Za-z0-9._@-]{1,64}", student_id) or student_id.startswith("."):
+                return self.reply(400, {'error': "bad or missing student"})
+            if not week.isdigit() or not 1 <= int(week) <= 8:
+                return self.reply(400, {'error': "week must be 1-8"})
+            
+            if not slots.acquire(blocking=False):
+                return self.reply(503, {'error': "busy"}, headers=[("Retry-After", "5")])
+            try:
+                with instrumentation.span("serve_bundle", student=student_id, week=int(week)):
+                    path = pool.serve(student_id, int(week), timeout=wait)
+            except PoolExhausted as e:
+                return self.reply(503, {'error': str(e)}, headers=[("Retry-After", str(math.ceil(wait)))])
+            except Exception as e:
+                return self.reply(500, {'error': str(e)})
+            finally:
+                slots.release()
+            
+            self.reply(200, path.read_bytes(), "application/zip",
+                       headers=[("Content-Disposition", f'attachment; filename="{path.name}"')])
+        
+        def log_message(self, format, *args):
+            print(f"{self.address_string()} - {format % args}")
+    
+    return http.server.ThreadingHTTPServer((host, port), Handler)
+
+
+def read_student_id(path):
+    """Student ID from a file, or None if the file is missing or empty"""
+    path = Path(path)
+    if not path.exists():
+        return None
+    return path.read_text().strip() or None
+
+
+def add_source_options(parser):
+    """Options shared by every command that generates questions (generate, batch, serve)"""
+    parser.add_argument("--theme", default="Cats", help="theme (default: Cats)")
+    parser.add_argument("--image-source", default="cataas",
+                        help="cataas, http://..., dir:PATH, or procedural[:SEED] (offline)")
+    parser.add_argument("--backend", default="subprocess", choices=sorted(STEGHIDE_BACKENDS),
+                        help="steghide backend (default: subprocess)")
+    parser.add_argument("--cover-cache", default="cover_cache",
+                        help="shared cover cache directory; '' to disable (default: cover_cache)")
+    parser.add_argument("--sheet-format", default="xlsx", choices=sorted(ROW_SINKS),
+                        help="spreadsheet format (default: xlsx)")
+    parser.add_argument("--fetch-workers", type=int, default=4, help="concurrent downloads (default: 4)")
+    parser.add_argument("--flag-index", default="flag_index.sqlite",
+                        help="database of every flag issued, keeps flags unique; '' to disable "
+                             "(default: flag_index.sqlite)")
+
+
+def add_generation_options(parser):
+    """Options shared by the generate and batch commands"""
+    parser.add_argument("--steg", type=int, default=25, help="steganography questions (default: 25)")
+    parser.add_argument("--encodings", type=int, default=25, help="encoding questions (default: 25)")
+    add_source_options(parser)
+    parser.add_argument("--reuse-covers", action="store_true",
+                        help="let this run use cached covers earlier runs were given (default: every cover once)")
+    parser.add_argument("--seed", help="master seed; the same seed reproduces the same flags and chains "
+                                       "(default: random, printed in the header)")
+    parser.add_argument("--time-budget", type=float, metavar="SECONDS",
+                        help="stop backfilling steganography questions after this long (default: no limit)")
+    parser.add_argument("--bundle", choices=list(BUNDLE_FORMATS),
+                        help="also pack stegged images and spreadsheets into one archive per week, "
+                             "built while generating (default: no archive)")
+    parser.add_argument("--no-originals", action="store_true",
+                        help="don't copy covers into original_images/ (they stay in the cover cache)")
+    parser.add_argument("--full-size-covers", action="store_true",
+                        help="embed into full-size covers (default: shrink each cover to fit the flag)")
+    parser.add_argument("--fresh", action="store_true",
+                        help="ignore earlier runs and regenerate everything (default: resume)")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="record per-stage timings: .json for a Chrome trace, .jsonl for JSON lines "
+                             "(batch: relative paths go in each week folder)")
+    only = parser.add_mutually_exclusive_group()
+    only.add_argument("--encodings-only", action="store_true", help="skip steganography questions")
+    only.add_argument("--steg-only", action="store_true", help="skip encoding questions")
+
+
+def build_parser():
+    """Command-line interface (running with no arguments starts the interactive prompts)"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(
+        prog="steghide_generator.py",
+        description="CAHSI hackathon question generator (run without arguments for interactive mode)"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    gen = commands.add_parser("generate", help="generate one week of questions without prompts")
+    gen.add_argument("--week", type=int, required=True, choices=range(1, 9), metavar="{1-8}",
+                     help="week number")
+    who = gen.add_mutually_exclusive_group()
+    who.add_argument("--student-id", help="student ID (overrides --student-id-file)")
+    who.add_argument("--student-id-file", default="STUDENT_ID.txt",
+                     help="file containing the student ID (default: STUDENT_ID.txt)")
+    gen.add_argument("--output-root", default=".", help="where week_N/ folders go (default: .)")
+    add_generation_options(gen)
+    gen.add_argument("--embed-workers", type=int, help="concurrent embeds (default: CPU cores)")
+    gen.add_argument("--verify-workers", type=int, help="concurrent verifies (default: CPU cores)")
+    
+    batch = commands.add_parser("batch", help="generate many students and weeks on a process pool")
+    batch.add_argument("--roster", required=True, help="file with one student ID per line")
+    batch.add_argument("--weeks", default="1-8", help="weeks to generate, e.g. 1-8 or 1,3,5 (default: 1-8)")
+    batch.add_argument("--output-root", default="cohort",
+                       help="per-student folders go here (default: cohort)")
+    batch.add_argument("--processes", type=int, help="worker processes (default: CPU cores)")
+    batch.add_argument("--prefetch", type=int,
+                       help="covers to have in the cache before starting (default: --steg for every job)")
+    add_generation_options(batch)
+    batch.add_argument("--embed-workers", type=int, help="concurrent embeds per job (default: cores / processes)")
+    batch.add_argument("--verify-workers", type=int, help="concurrent verifies per job (default: cores / processes)")
+    
+    prefetch = commands.add_parser("prefetch", help="download covers into the shared cover cache")
+    prefetch.add_argument("count", type=int, help="number of covers to download")
+    prefetch.add_argument("--cache", default="cover_cache", help="cache directory (default: cover_cache)")
+    prefetch.add_argument("--max-mb", type=int, default=500, help="cache size budget in MB (default: 500)")
+    prefetch.add_argument("--source", default="cataas",
+                          help="image source: cataas, http://..., dir:PATH, or procedural[:SEED]")
+    prefetch.add_argument("--workers", type=int, default=8, help="concurrent downloads (default: 8)")
+    
+    index = commands.add_parser("import-flags", help="add the flags of existing spreadsheets to the flag index")
+    index.add_argument("sheets", nargs="+", help="question spreadsheets (.xlsx, .csv or .parquet)")
+    index.add_argument("--index", default="flag_index.sqlite", help="flag index (default: flag_index.sqlite)")
+    
+    verify = commands.add_parser("verify-encodings", help="check that encoding banks decode back to their flags")
+    verify.add_argument("banks", nargs="+", help="encoding spreadsheets (.xlsx, .csv or .parquet)")
+    verify.add_argument("--report", help="write the per-question report to this CSV file")
+    
+    serve = commands.add_parser("serve", help="serve pre-generated week bundles over HTTP on localhost")
+    serve.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    serve.add_argument("--port", type=int, default=8399, help="port (default: 8399)")
+    serve.add_argument("--pool", default="challenge_pool", help="pool and served-bundle folder (default: challenge_pool)")
+    serve.add_argument("--steg", type=int, default=25, help="steganography questions per bundle (default: 25)")
+    serve.add_argument("--encodings", type=int, default=25, help="encoding questions per bundle (default: 25)")
+    serve.add_argument("--steg-pool", type=int, default=100, help="stegged images to keep ready (default: 100)")
+    serve.add_argument("--encoding-pool", type=int, default=250, help="encoding questions to keep ready (default: 250)")
+    serve.add_argument("--low-water", type=float, default=0.5,
+                       help="refill when the pool drops below this fraction of its size (default: 0.5)")
+    serve.add_argument("--max-requests", type=int, default=4, help="bundles built at once; more get 503 (default: 4)")
+    serve.add_argument("--wait", type=float, default=30,
+                       help="seconds a request waits for an empty pool to refill before 503 (default: 30)")
+    add_source_options(serve)
+    
+    audit = commands.add_parser("verify-steg", help="re-extract every stegged image and compare with its spreadsheet")
+    audit.add_argument("paths", nargs="+", help="week, steganography or cohort folders, or *_stegs sheets")
+    audit.add_argument("--backend", default="subprocess", choices=sorted(STEGHIDE_BACKENDS),
+                       help="steghide backend (default: subprocess)")
+    audit.add_argument("--workers", type=int, help="concurrent extracts (default: CPU cores)")
+    audit.add_argument("--cache", default="steg_verify_cache.jsonl",
+                       help="results of earlier checks, by image hash; '' to disable "
+                            "(default: steg_verify_cache.jsonl)")
+    audit.add_argument("--report", help="write the per-image report to this CSV file")
+    
+    return parser
+
+
+def generate_command(args):
+    """Non-interactive generation of one week"""
+    student_id = args.student_id or read_student_id(args.student_id_file)
+    if not student_id:
+        print(f"ERROR: no student ID (pass --student-id or create {args.student_id_file})")
+        return 1
+    
+    with instrumentation.trace(args.trace) if args.trace else contextlib.nullcontext():
+        week_dir = generate_week(student_id, args.week, output_root=args.output_root,
+                                 **generation_options(args))
+    return 0 if week_dir else 1
+
+
+def generation_options(args):
+    """generate_week() keyword arguments from parsed command-line options"""
+    options = dict(
+        steg=0 if args.encodings_only else args.steg,
+        encoding=0 if args.steg_only else args.encodings,
+        theme=args.theme,
+        image_source=args.image_source,
+        backend=args.backend,
+        cover_cache=args.cover_cache or None,
+        reuse_covers=args.reuse_covers,
+        sheet_format=args.sheet_format,
+        fetch_workers=args.fetch_workers,
+        fresh=args.fresh,
+        plan_covers=not args.full_size_covers,
+        seed=args.seed,
+        flag_index=args.flag_index or None,
+        time_budget=args.time_budget,
+        keep_originals=not args.no_originals,
+        bundle=args.bundle,
+    )
+    if args.embed_workers:
+        options["embed_workers"] = args.embed_workers
+    if args.verify_workers:
+        options["verify_workers"] = args.verify_workers
+    return options
+
+
+def batch_command(args):
+    """Generate a whole cohort"""
+    students = read_roster(args.roster)
+    if not students:
+        print(f"ERROR: no student IDs in {args.roster}")
+        return 1
+    
+    try:
+        weeks = parse_weeks(args.weeks)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return 1
+    
+    failed = run_batch(students, weeks, output_root=args.output_root, processes=args.processes,
+                       prefetch=args.prefetch, trace=args.trace, **generation_options(args))
+    return 1 if failed else 0
+
+
+def prefetch_command(args):
+    """Fill the shared cover cache ahead of time"""
+    cache = CoverCache(args.cache, args.max_mb * 1024 * 1024,
+                       image_source=make_image_source(args.source, pool_size=args.workers))
+    added = cache.prefetch(args.count, workers=args.workers)
+    
+    print(f"✓ Added {added} new covers")
+    print(f"✓ Cache: {len(cache.covers())} covers ({len(cache.available())} not issued yet), "
+          f"{cache.size() / 1024 / 1024:.1f} MB in {cache.root}")
+    return 0
+
+
+def import_flags_command(args):
+    """Register the flags of existing spreadsheets, reporting duplicates"""
+    flag_index = FlagIndex(args.index)
+    duplicates = 0
+    
+    for sheet in args.sheets:
+        start = time.time()
+        read, collided = flag_index.import_sheet(sheet)
+        duplicates += len(collided)
+        status = "✅" if not collided else "⚠️"
+        print(f"{status} {sheet}: {read} flags, {len(collided)} duplicates ({time.time() - start:.2f}s)")
+        for flag, owner in collided[:10]:
+            print(f"   {owner}: {flag} is already used")
+    
+    print(f"✓ Flag index: {args.index} ({len(flag_index)} flags)")
+    flag_index.close()
+    return 1 if duplicates else 0
+
+
+def verify_encodings_command(args):
+    """Decode every question in one or more encoding banks"""
+    verifier = EncodingVerifier()
+    failed = 0
+    reports = []
+    
+    for bank in args.banks:
+        start = time.time()
+        report = verifier.verify(bank)
+        report.insert(0, 'Bank', bank)
+        reports.append(report)
+        
+        bad = (report['Decoded'] != '✓').sum()
+        ambiguous = (report['Ambiguity'] != "").sum()
+        failed += bad
+        status = "✅" if not bad else "✗"
+        print(f"{status} {bank}: {len(report) - bad}/{len(report)} decode, "
+              f"{ambiguous} ambiguous ({time.time() - start:.2f}s)")
+    
+    if args.report:
+        import pandas as pd
+        
+        pd.concat(reports).to_csv(args.report, index=False)
+        print(f"✓ Report: {args.report}")
+    
+    return 1 if failed else 0
+
+
+def serve_command(args):
+    """Run the warm pool service until interrupted"""
+    try:
+        pool = ChallengePool(
+            args.pool,
+            steg=args.steg,
+            encoding=args.encodings,
+            steg_capacity=args.steg_pool,
+            encoding_capacity=args.encoding_pool,
+            low_water=args.low_water,
+            theme=args.theme,
+            sheet_format=args.sheet_format,
+            flag_index=FlagIndex(args.flag_index) if args.flag_index else None,
+            steg_options=dict(
+                image_source=make_image_source(args.image_source, theme=args.theme, pool_size=args.fetch_workers,
+                                               stream="serve"),
+                cover_cache=CoverCache(args.cover_cache) if args.cover_cache else None,
+                backend=args.backend,
+                fetch_workers=args.fetch_workers,
+            ),
+        )
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return 1
+    server = make_pool_server(pool, args.host, args.port, max_requests=args.max_requests, wait=args.wait)
+    
+    print(f"✓ Pool: {pool.status()}")
+    print(f"✓ Serving on http://{args.host}:{server.server_port}/bundle?student=ID&week=N (Ctrl+C to stop)")
+    pool.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping (finishing the refill in progress)...")
+    finally:
+        server.server_close()
+        pool.stop()
     return 0
 
 
+def verify_steg_command(args):
+    """Audit existing steganography output, reporting every image that differs from its sheet"""
+    start = time.time()
+    verifier = SteghideVerifier(args.backend, workers=args.workers, cache=args.cache or None)
+    reports = verifier.verify(args.paths)
+    if not reports:
+        print(f"ERROR: no *_stegs spreadsheets found in {', '.join(args.paths)}")
+        return 1
+    
+    by_sheet = {}
+    for report in reports:
+        by_sheet.setdefault(report['Sheet'], []).append(report)
+    for sheet, rows in by_sheet.items():
+        problems = [row for row in rows if row['Status'] != 'ok']
+        status = "✅" if not problems else "✗"
+        print(f"{status} {sheet}: {len(rows) - len(problems)}/{len(rows)} ok")
+        for row in problems[:10]:
+            detail = f" (extracted {row['Extracted']!r})" if row['Status'] == 'mismatch' else ""
+            print(f"   {row['Status']}: {row['File-Name']}{detail}")
+    
+    failed = sum(1 for report in reports if report['Status'] != 'ok')
+    cached = sum(1 for report in reports if report['Cached'])
+    print(f"✓ Checked {len(reports)} images in {time.time() - start:.1f}s "
+          f"({cached} unchanged since the last check, {failed} problems)")
+    
+    if args.report:
+        with open(args.report, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=STEG_REPORT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(reports)
+        print(f"✓ Report: {args.report}")
+    
+    return 1 if failed else 0
+
+
+COMMANDS = {
+    "generate": generate_command,
+    "batch": batch_command,
+    "prefetch": prefetch_command,
+    "import-flags": import_flags_command,
+    "verify-encodings": verify_encodings_command,
+    "verify-steg": verify_steg_command,
+    "serve": serve_command,
+}
+
+
+def cli(argv):
+    """Run a command-line subcommand"""
+    args = build_parser().parse_args(argv)
+    return COMMANDS[args.command](args)
+
+
 if __name__ == "__main__":
-    exit(main())
\ No newline at end of file
+    import sys
+    if len(sys.argv) > 1:
+        exit(cli(sys.argv[1:]))
+    exit(main())